@@ -0,0 +1,372 @@
+"""Audio previews of MIDI files, rendered once and served from disk
+
+A preview is the MIDI file with its leading silence trimmed, rendered to
+WAV with FluidSynth (in-process through a SynthPool, or the fluidsynth CLI)
+and optionally compressed to Ogg/Opus with ffmpeg.
+Previews go to a content-addressed ContentStore keyed by the MIDI bytes,
+the soundfont, the gain and the encoding, so replays and popular patterns
+are read straight from the store. The web app also renders the top search
+results in the background so they are ready before the user clicks play,
+and with a SynthPool a preview that is not stored yet is streamed to the
+client while it renders (see PreviewStream).
+"""
+import os
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+import pretty_midi
+from content_cache import ContentStore, file_digest
+from synth_pool import SynthPool, wav_header
+from config import AUDIO_PREVIEW_FORMAT, AUDIO_PREVIEW_GAIN, AUDIO_PREVIEW_BITRATE, AUDIO_PRERENDER_WORKERS
+
+# Bump when the rendering changes so stored previews are re-rendered
+AUDIO_PREVIEW_VERSION = 1
+
+AUDIO_FORMATS = {
+    # format -> (file suffix, mimetype)
+    'wav': ('.wav', 'audio/wav'),
+    'opus': ('.ogg', 'audio/ogg')
+}
+
+# Rendered audio is sent in chunks of at least this many bytes (about 0.4 s of audio)
+STREAM_CHUNK_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def create_trimmed_midi(midi_file):
+    """Create a trimmed version of a MIDI file by removing silence at the beginning
+
+    Args:
+        midi_file: Path to the original MIDI file
+
+    Returns:
+        Path to the temporary trimmed MIDI file or None if error
+    """
+    try:
+        # Load MIDI
+        midi_data = pretty_midi.PrettyMIDI(midi_file)
+
+        # Find start time automatically
+        start_time = float('inf')
+        for instrument in midi_data.instruments:
+            if not instrument.is_drum and instrument.notes:
+                first_note = min(instrument.notes, key=lambda x: x.start)
+                start_time = min(start_time, first_note.start)
+
+        if start_time == float('inf'):
+            start_time = 0
+
+        if start_time > 0:
+            logger.info(f"Trimming MIDI file, removing {start_time:.2f}s of silence from beginning")
+
+            # Shift all notes to remove empty space
+            for instrument in midi_data.instruments:
+                for note in instrument.notes:
+                    note.start -= start_time
+                    note.end -= start_time
+
+        # Save to temporary file
+        fd, temp_path = tempfile.mkstemp(suffix='.mid')
+        os.close(fd)
+        midi_data.write(temp_path)
+
+        return temp_path
+
+    except Exception as e:
+        logger.error(f"Error creating trimmed MIDI: {str(e)}")
+        return None
+
+
+def midi_to_wav(midi_path, soundfont_path, gain=AUDIO_PREVIEW_GAIN):
+    """Convert a MIDI file to WAV using FluidSynth
+
+    Args:
+        midi_path: Path to the MIDI file
+        soundfont_path: Path to the .sf2 soundfont
+        gain: FluidSynth gain (volume)
+
+    Returns:
+        Path to the temporary WAV file or None if error
+    """
+    try:
+        # First, create a trimmed MIDI file without silence
+        trimmed_midi = create_trimmed_midi(midi_path)
+        if not trimmed_midi:
+            return None
+
+        # Create a temporary WAV file
+        fd, wav_path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+
+        # Use FluidSynth to convert MIDI to WAV
+        cmd = [
+            'fluidsynth',
+            '-ni',
+            '-g', str(gain),
+            '-F', wav_path,
+            soundfont_path,
+            trimmed_midi
+        ]
+
+        logger.info(f"Converting MIDI to WAV: {' '.join(cmd)}")
+        result = subprocess.run(cmd, capture_output=True, text=True)
+
+        # Check if conversion was successful
+        if result.returncode != 0:
+            logger.error(f"FluidSynth error: {result.stderr}")
+            os.remove(trimmed_midi)
+            os.remove(wav_path)
+            return None
+
+        # Clean up the trimmed MIDI file
+        os.remove(trimmed_midi)
+
+        return wav_path
+
+    except Exception as e:
+        logger.error(f"MIDI to WAV conversion error: {str(e)}")
+        return None
+
+
+def wav_to_opus(wav_path: str, bitrate: str = AUDIO_PREVIEW_BITRATE) -> Optional[bytes]:
+    """Compress a WAV file to Ogg/Opus with ffmpeg, None if ffmpeg is missing or fails"""
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', wav_path,
+           '-c:a', 'libopus', '-b:a', bitrate, '-f', 'ogg', 'pipe:1']
+    try:
+        result = subprocess.run(cmd, capture_output=True)
+    except OSError as e:
+        logger.error(f"Opus encoding error: {str(e)}")
+        return None
+    if result.returncode != 0:
+        logger.error(f"ffmpeg error: {result.stderr.decode(errors='replace')}")
+        return None
+    return result.stdout
+
+
+class AudioPreviewStore:
+    def __init__(self, store_dir: str, soundfont_path: str, gain: float = AUDIO_PREVIEW_GAIN,
+                 audio_format: str = AUDIO_PREVIEW_FORMAT, prerender_workers: int = AUDIO_PRERENDER_WORKERS,
+                 synth_pool: Optional[SynthPool] = None):
+        """
+        Args:
+            store_dir: Directory of the content-addressed preview store
+            soundfont_path: Soundfont used for rendering
+            gain: FluidSynth gain (volume)
+            audio_format: 'wav' or 'opus' (needs ffmpeg with libopus)
+            prerender_workers: Background threads rendering previews ahead of time
+            synth_pool: In-process synthesizers to render with, None runs the fluidsynth CLI
+        """
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unknown audio format: {audio_format}")
+        suffix, self.mimetype = AUDIO_FORMATS[audio_format]
+        self.store = ContentStore(store_dir, suffix)
+        self.soundfont_path = soundfont_path
+        self.gain = gain
+        self.audio_format = audio_format
+        self.synth_pool = synth_pool
+        self.renderer = 'pool' if synth_pool is not None else 'cli'
+        self._executor = ThreadPoolExecutor(max_workers=max(1, prerender_workers),
+                                            thread_name_prefix='audio-prerender')
+        self._inflight = {}  # key -> Future of a render in progress
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.failures = 0
+        self.prerenders_queued = 0
+
+    def _soundfont_id(self) -> str:
+        """Identity of the soundfont file, without hashing its megabytes on every request"""
+        try:
+            st = os.stat(self.soundfont_path)
+            return f'{os.path.abspath(self.soundfont_path)}:{st.st_size}:{st.st_mtime_ns}'
+        except OSError:
+            return os.path.abspath(self.soundfont_path)
+
+    def key_for(self, midi_path: str) -> str:
+        """Content address of a file's preview with the current soundfont, gain and format"""
+        salt = (f'audio:{AUDIO_PREVIEW_VERSION}:{self._soundfont_id()}:{self.gain}:'
+                f'{self.audio_format}:{self.renderer}')
+        return file_digest(midi_path, salt=salt)
+
+    def get(self, midi_path: str) -> Optional[str]:
+        """Path of the stored preview of a MIDI file, rendering it on a miss
+
+        Concurrent requests for the same preview wait for a single render.
+
+        Returns:
+            Path of the audio file in the store, or None if rendering failed
+        """
+        key = self.key_for(midi_path)
+        path = self.store.blob_path(key)
+        if path is not None:
+            with self._lock:
+                self.hits += 1
+            return path
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        path = None
+        try:
+            path = self._render(key, midi_path)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            future.set_result(path)
+        return path
+
+    def _render(self, key: str, midi_path: str) -> Optional[str]:
+        with self._lock:
+            self.misses += 1
+        if self.synth_pool is not None:
+            wav_path = self.synth_pool.render_to_wav(midi_path)
+        else:
+            wav_path = midi_to_wav(midi_path, self.soundfont_path, self.gain)
+        if not wav_path:
+            with self._lock:
+                self.failures += 1
+            return None
+        return self._store_wav(key, wav_path)
+
+    def _store_wav(self, key: str, wav_path: str) -> Optional[str]:
+        """Encode a rendered temporary WAV file into the store and delete it"""
+        try:
+            if self.audio_format == 'opus':
+                data = wav_to_opus(wav_path)
+            else:
+                with open(wav_path, 'rb') as f:
+                    data = f.read()
+        finally:
+            os.remove(wav_path)
+        if data is None:
+            with self._lock:
+                self.failures += 1
+            return None
+
+        self.store.put(key, data, {'format': self.audio_format, 'gain': self.gain,
+                                   'soundfont': os.path.basename(self.soundfont_path)})
+        with self._lock:
+            self.renders += 1
+        return self.store.blob_path(key)
+
+    def open_stream(self, midi_path: str) -> Optional['PreviewStream']:
+        """Start rendering a preview that is not stored yet, to be sent while it renders
+
+        Returns None when the preview should be served from the store
+        instead: it is already stored, another render of it is in progress,
+        or there is no SynthPool to render incrementally.
+
+        Raises:
+            SynthPoolBusy: If no synthesizer became free in time
+        """
+        if self.synth_pool is None:
+            return None
+        key = self.key_for(midi_path)
+        with self._lock:
+            if key in self._inflight or self.store.blob_path(key) is not None:
+                return None
+            self.misses += 1
+        total_frames, blocks = self.synth_pool.open_stream(midi_path)
+        return PreviewStream(self, key, total_frames, blocks)
+
+    def prerender(self, midi_paths: Iterable[str]):
+        """Queue previews to be rendered in the background, skipping ones already stored"""
+        for midi_path in midi_paths:
+            with self._lock:
+                self.prerenders_queued += 1
+            self._executor.submit(self._prerender, midi_path)
+
+    def _prerender(self, midi_path: str):
+        try:
+            self.get(midi_path)
+        except Exception as e:
+            logger.error(f"Error pre-rendering preview for {midi_path}: {str(e)}")
+
+    def stats(self):
+        """Hit, miss, render and pre-render counters of this process"""
+        with self._lock:
+            return {
+                'directory': self.store.directory,
+                'format': self.audio_format,
+                'renderer': self.renderer,
+                'hits': self.hits,
+                'misses': self.misses,
+                'renders': self.renders,
+                'failures': self.failures,
+                'prerenders_queued': self.prerenders_queued,
+                'rendering': len(self._inflight)
+            }
+
+
+class PreviewStream:
+    """A preview sent as WAV bytes while the synthesizer renders it
+
+    The WAV header carries the exact length, so a stream can answer byte
+    range requests: bytes before the range are rendered and dropped. A
+    stream that covers the whole file is also written to the preview store
+    (encoded to the store's format) once the last block is rendered.
+    """
+
+    def __init__(self, previews: AudioPreviewStore, key: str, total_frames: int, blocks: Iterator):
+        self.previews = previews
+        self.key = key
+        self.header = wav_header(total_frames)
+        self.size = len(self.header) + total_frames * 4
+        self.mimetype = 'audio/wav'
+        self._blocks = blocks
+
+    def chunks(self, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes [start, stop) of the WAV file, rendered as they are sent"""
+        stop = self.size if stop is None else min(stop, self.size)
+        tee = tee_path = None
+        if start == 0 and stop == self.size:
+            fd, tee_path = tempfile.mkstemp(suffix='.wav')
+            tee = os.fdopen(fd, 'wb')
+
+        position = 0
+        pending = bytearray()
+        completed = False
+        try:
+            for data in self._iter_bytes():
+                if tee is not None:
+                    tee.write(data)
+                # Part of this piece inside the requested range
+                low, high = max(start - position, 0), min(stop - position, len(data))
+                position += len(data)
+                if low < high:
+                    pending += data[low:high]
+                if len(pending) >= STREAM_CHUNK_BYTES:
+                    yield bytes(pending)
+                    pending.clear()
+                if position >= stop and tee is None:
+                    break
+            if pending:
+                yield bytes(pending)
+            completed = tee is not None and position == self.size
+        finally:
+            self.close()
+            if tee is not None:
+                tee.close()
+                if completed:
+                    self.previews._store_wav(self.key, tee_path)
+                else:
+                    os.remove(tee_path)
+
+    def _iter_bytes(self) -> Iterator[bytes]:
+        yield self.header
+        for block in self._blocks:
+            yield block.tobytes()
+
+    def close(self):
+        """Stop rendering and hand the synthesizer back to the pool"""
+        self._blocks.close()
@@ -0,0 +1,53 @@
+"""Recall@k vs latency report for the approximate index types
+
+Builds (or loads) the database once per index type and sweeps the query-time
+parameter (nprobe for IVF, efSearch for HNSW) against the exact flat baseline.
+
+Usage:
+    python benchmark_index.py [dataset_path] [--k 10] [--queries 500]
+"""
+import argparse
+import logging
+from database import MIDIDatabase
+from config import DATASET_PATH
+
+SWEEPS = {
+    'ivf': ('nprobe', [1, 2, 4, 8, 16, 32, 64, 128]),
+    'hnsw': ('efSearch', [16, 32, 64, 128, 256, 512]),
+}
+
+
+def set_search_param(db: MIDIDatabase, value: int):
+    if db.index_type == 'ivf':
+        db.index.nprobe = min(value, db.index.nlist)
+    else:
+        db.index.hnsw.efSearch = value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataset_path', nargs='?', default=DATASET_PATH)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rows = []
+    for index_type, (param, values) in SWEEPS.items():
+        db = MIDIDatabase(index_type=index_type)
+        db.initialize(args.dataset_path)
+        logging.getLogger().setLevel(logging.WARNING)
+        for value in values:
+            set_search_param(db, value)
+            report = db.evaluate_index(k=args.k, n_queries=args.queries)
+            if report:
+                rows.append((index_type, f'{param}={value}', report))
+        logging.getLogger().setLevel(logging.INFO)
+
+    print(f"\n{'index':<6} {'setting':<14} {'recall@k':>9} {'ms/query':>9} {'flat ms/query':>14}")
+    for index_type, setting, report in rows:
+        print(f"{index_type:<6} {setting:<14} {report['recall']:>9.3f} "
+              f"{report['ms_per_query']:>9.3f} {report['flat_ms_per_query']:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
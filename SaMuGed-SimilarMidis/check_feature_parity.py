@@ -0,0 +1,99 @@
+"""Parity check between the 'raw' and 'pretty_midi' feature engines
+
+Generates a toy synthetic corpus (several instruments, drums, tempo changes,
+overlapping same-pitch notes) and checks that both engines produce identical
+feature dicts, bit for bit, and that the array-based tempo estimate matches
+PrettyMIDI.estimate_tempo. Pass a directory to check real MIDI files instead.
+
+Usage:
+    python check_feature_parity.py [midi_dir]
+"""
+import os
+import sys
+import random
+import logging
+import tempfile
+import time
+import numpy as np
+import pretty_midi
+from feature_calculator import FeatureCalculator
+from midi_reader import read_note_arrays, estimate_tempo
+
+
+def write_toy_corpus(out_dir: str, n_files: int = 200, seed: int = 0):
+    """Write random multi-instrument MIDI files into out_dir"""
+    rng = random.Random(seed)
+    for i in range(n_files):
+        midi = pretty_midi.PrettyMIDI(initial_tempo=rng.choice([72, 90, 120, 128, 174]),
+                                      resolution=rng.choice([96, 220, 480, 960]))
+        # Occasional tempo change later in the file
+        if rng.random() < 0.3:
+            midi._tick_scales.append((midi.time_to_tick(rng.uniform(1, 4)),
+                                      60.0 / (rng.choice([100, 140]) * midi.resolution)))
+        for j in range(rng.randint(1, 4)):
+            instrument = pretty_midi.Instrument(program=rng.randint(0, 127), is_drum=(j == 3))
+            t = rng.random() * 2
+            for _ in range(rng.randint(0, 80)):
+                duration = rng.choice([0.1, 0.125, 0.25, 0.5, 1.0])
+                instrument.notes.append(pretty_midi.Note(
+                    rng.randint(1, 127), rng.randint(24, 96), t, t + duration))
+                t += rng.choice([0, 0, 0.05, 0.125, 0.25, 0.5])
+            midi.instruments.append(instrument)
+        midi.write(os.path.join(out_dir, f'toy_{i:04d}.mid'))
+
+
+def same(a, b) -> bool:
+    if a is None or b is None:
+        return a is b
+    return a.keys() == b.keys() and all(a[k] == b[k] or (a[k] != a[k] and b[k] != b[k]) for k in a)
+
+
+def same_tempo(path: str) -> bool:
+    """Compare the array-based tempo estimate with PrettyMIDI.estimate_tempo"""
+    try:
+        expected = pretty_midi.PrettyMIDI(path).estimate_tempo()
+    except ValueError:
+        expected = None
+    try:
+        actual = estimate_tempo(np.sort(read_note_arrays(path).onset))
+    except ValueError:
+        actual = None
+    return expected == actual
+
+
+def check(midi_dir: str) -> int:
+    paths = [os.path.join(root, f) for root, _, files in os.walk(midi_dir)
+             for f in files if f.lower().endswith(('.mid', '.midi'))]
+    reference = FeatureCalculator(engine='pretty_midi')
+    fast = FeatureCalculator(engine='raw')
+    mismatches = 0
+    times = {'pretty_midi': 0.0, 'raw': 0.0}
+    for path in sorted(paths):
+        start = time.perf_counter()
+        expected = reference.extract_features(path)
+        times['pretty_midi'] += time.perf_counter() - start
+        start = time.perf_counter()
+        actual = fast.extract_features(path)
+        times['raw'] += time.perf_counter() - start
+        if not same(expected, actual):
+            mismatches += 1
+            print(f"MISMATCH {path}\n  pretty_midi: {expected}\n  raw:         {actual}")
+        elif expected is not None and not same_tempo(path):
+            mismatches += 1
+            print(f"TEMPO MISMATCH {path}")
+    print(f"{len(paths)} files, {mismatches} mismatches, "
+          f"pretty_midi {times['pretty_midi']:.2f}s, raw {times['raw']:.2f}s")
+    return mismatches
+
+
+def main():
+    logging.disable(logging.WARNING)
+    if len(sys.argv) > 1:
+        sys.exit(1 if check(sys.argv[1]) else 0)
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        write_toy_corpus(corpus_dir)
+        sys.exit(1 if check(corpus_dir) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,3 +13,47 @@ DEFAULT_FEATURE_WEIGHTS = {
 
 MAX_RESULTS = 33
 DATASET_PATH = "datasets/Lakh_MIDI_Clean_Patterns_v1"
+
+# Dataset ingestion (feature extraction) settings
+INGEST_WORKERS = None  # None = one worker per CPU core, 1 = process files in-process
+INGEST_CHUNK_SIZE = 64  # Files handed to a worker per task
+
+# Feature cache settings
+CACHE_FINGERPRINT = 'mtime'  # 'mtime' = size + modification time, 'content' = size + SHA-1 of file bytes
+
+# Similarity index settings
+INDEX_TYPE = 'flat'  # 'flat' = exact search, 'ivf' / 'hnsw' = approximate search for large libraries
+IVF_NLIST = 1024  # Number of inverted lists (capped at one list per 39 patterns)
+IVF_NPROBE = 16  # Lists visited per query, higher = better recall, slower
+HNSW_M = 32  # Graph neighbours per node
+HNSW_EF_CONSTRUCTION = 80  # Candidate list size while building the graph
+HNSW_EF_SEARCH = 64  # Candidate list size per query, higher = better recall, slower
+
+# Feature extraction settings
+FEATURE_ENGINE = 'raw'  # 'raw' = parse MIDI bytes into note arrays, 'pretty_midi' = build a full PrettyMIDI object
+TEMPO_STRATEGY = 'full'  # 'full' = estimate over all onsets, 'window' = estimate over the first TEMPO_WINDOW_ONSETS onsets, 'header' = first tempo in the file's tempo map
+TEMPO_WINDOW_ONSETS = 256
+
+# Web app cache settings
+PIANO_ROLL_CACHE_ENTRIES = 512  # Piano rolls kept in memory per process, older ones are re-read from the on-disk store
+PIANO_ROLL_CACHE_MB = 64  # Memory budget for cached piano roll images per process
+UPLOAD_CACHE_ENTRIES = 256  # Uploaded query files kept, the least recently used upload is deleted beyond this
+PIANO_ROLL_MODE = 'image'  # 'image' = PNG per piano roll, 'notes' = compact note arrays drawn on a canvas by the browser
+PRECOMPUTE_THUMBNAILS = True  # Render piano rolls for the whole dataset at startup (see thumbnails.py)
+
+# Audio preview settings
+AUDIO_PREVIEW_FORMAT = 'wav'  # 'wav' = uncompressed, 'opus' = Ogg/Opus via ffmpeg, much smaller on disk and over the wire
+AUDIO_PREVIEW_BITRATE = '64k'  # Opus bitrate
+AUDIO_PREVIEW_GAIN = 0.7  # FluidSynth gain (volume)
+AUDIO_PRERENDER_RESULTS = 5  # Top search results rendered in the background after each search, 0 = off
+AUDIO_PRERENDER_WORKERS = 1  # Background threads rendering previews
+AUDIO_RENDERER = 'pool'  # 'pool' = in-process synthesizers with the soundfont kept loaded, 'cli' = fluidsynth subprocess per render
+SYNTH_POOL_SIZE = 2  # In-process synthesizers (each holds its own copy of the soundfont), i.e. concurrent renders
+SYNTH_QUEUE_LIMIT = 16  # Renders allowed to wait for a synthesizer, further ones are rejected with 503
+SYNTH_QUEUE_TIMEOUT = 30  # Seconds a render waits for a synthesizer
+
+# Production web server settings (web/gunicorn.conf.py)
+WEB_BIND = '0.0.0.0:5000'
+WEB_WORKERS = 2  # Worker processes forked after the database is loaded, each with its own synthesizer pool
+WEB_THREADS = 8  # Request threads per worker process
+WEB_TIMEOUT = 120  # Seconds a worker may stay silent before it is restarted
@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def file_digest(path: str, salt: str = '') -> str:
+    """SHA-1 hex digest of a file's bytes, optionally mixed with a salt
+
+    The salt lets callers version derived artifacts (e.g. render settings)
+    so a change in how they are produced gives them a new address.
+    """
+    digest = hashlib.sha1(salt.encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache bounded by entry count and total size
+
+    Args:
+        max_entries: Maximum number of entries, None for no limit
+        max_bytes: Maximum summed size of the entries, None for no limit
+        size_fn: Returns the size in bytes of a value, used with max_bytes
+        on_evict: Called with (key, value) for every entry dropped to make room
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 size_fn: Callable[[Any], int] = lambda value: 0,
+                 on_evict: Optional[Callable[[Any, Any], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.on_evict = on_evict
+        self._entries = OrderedDict()  # key -> (value, size), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value and mark it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Insert or replace a value, evicting least recently used entries if over budget"""
+        size = self.size_fn(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            evicted = self._evict_locked()
+        self._notify(evicted)
+
+    def pop(self, key, default=None):
+        """Remove an entry without counting it as an eviction"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def _evict_locked(self):
+        evicted = []
+        # Always keep the newest entry, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key, (value, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            evicted.append((key, value))
+        return evicted
+
+    def _notify(self, evicted):
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def stats(self) -> Dict:
+        """Counters for monitoring hit rate and eviction pressure"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class ContentStore:
+    """Content-addressed artifact store on disk
+
+    Each artifact is a blob file plus a small JSON metadata sidecar, stored
+    under a two-level fan-out of its key. Files are written to a temporary
+    name and renamed into place, so several processes can share one store:
+    readers either see a complete artifact or none at all.
+
+    Args:
+        directory: Root directory of the store, created on demand
+        suffix: File extension of the blobs, e.g. '.png'
+    """
+
+    def __init__(self, directory: str, suffix: str):
+        self.directory = directory
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, key[:2], key)
+        return base + self.suffix, base + '.json'
+
+    def blob_path(self, key: str) -> Optional[str]:
+        """Path of the stored blob, or None if the artifact is not stored"""
+        blob_path, meta_path = self._paths(key)
+        return blob_path if os.path.exists(meta_path) else None
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Dict]]:
+        """Return (blob bytes, metadata) or None if the artifact is not stored"""
+        blob_path, meta_path = self._paths(key)
+        try:
+            # The sidecar is written last, so its presence means the blob is complete
+            with open(meta_path) as f:
+                metadata = json.load(f)
+            with open(blob_path, 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data, metadata
+
+    def put(self, key: str, data: bytes, metadata: Dict):
+        """Store an artifact atomically, replacing any previous version"""
+        blob_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        self._write_atomic(blob_path, data)
+        self._write_atomic(meta_path, json.dumps(metadata).encode())
+        with self._lock:
+            self.writes += 1
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stats(self) -> Dict:
+        """Counters for this process' reads and writes"""
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes
+            }
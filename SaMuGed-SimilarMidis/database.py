@@ -1,18 +1,72 @@
 import os
+import time
+import hashlib
 import numpy as np
-import pickle
-from typing import List, Dict, Tuple
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Dict, Optional, Tuple
 import faiss
 import logging
 from sklearn.preprocessing import StandardScaler
-from config import DEFAULT_FEATURE_WEIGHTS, DATASET_PATH, MAX_RESULTS
+from config import (DEFAULT_FEATURE_WEIGHTS, DATASET_PATH, MAX_RESULTS,
+                    INGEST_WORKERS, INGEST_CHUNK_SIZE, CACHE_FINGERPRINT,
+                    INDEX_TYPE, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION,
+                    HNSW_EF_SEARCH)
 from feature_calculator import FeatureCalculator
 
+# Bump when the cache layout changes so stale caches are rebuilt
+CACHE_VERSION = 3
+
+# Per-process calculator used by ingestion workers
+_worker_calculator = None
+
+
+def _init_ingest_worker(calculator_settings: Dict):
+    """Create the feature calculator once per worker process"""
+    global _worker_calculator
+    _worker_calculator = FeatureCalculator(**calculator_settings)
+
+
+def _extract_chunk(paths: List[str]) -> List[Tuple[str, Optional[Dict], Optional[str]]]:
+    """Extract features for a chunk of files inside a worker process
+
+    Returns (path, features, error) for every input path, in input order.
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append((path, _worker_calculator.extract_features(path), None))
+        except Exception as e:
+            results.append((path, None, str(e)))
+    return results
+
+
 class MIDIDatabase:
-    def __init__(self):
+    def __init__(self, workers: Optional[int] = INGEST_WORKERS,
+                 chunk_size: int = INGEST_CHUNK_SIZE,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 index_type: str = INDEX_TYPE):
+        """
+        Args:
+            workers: Number of ingestion processes (None = all cores, 1 = in-process)
+            chunk_size: Number of files submitted to a worker per task
+            progress_callback: Optional callable receiving (done, total) during ingestion
+            index_type: 'flat', 'ivf' or 'hnsw' (see config.py)
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self.progress_callback = progress_callback
+        self.index_type = index_type
         self.index = None
         self.scaler = StandardScaler()
         self.file_paths = []
+        self.fingerprints = []  # (size, mtime_ns) or (size, sha1 prefix) per entry in file_paths
+        self.failed_files = {}  # path -> fingerprint of files that yielded no features
+        self.fingerprint_mode = CACHE_FINGERPRINT
+        self.cache_digest = None  # digest of the saved feature store, keys the persisted index
+        self.dataset_path = DATASET_PATH
+        self.path_ids = {}  # normalized path -> id (row in file_paths)
+        self.basename_ids = {}  # file name -> id of the first file with that name
         self.feature_matrix = None
         self.calculator = FeatureCalculator()
         self.cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
@@ -34,72 +88,202 @@ class MIDIDatabase:
             self.logger.info(f"Created cache directory: {self.cache_dir}")
 
     def _get_cache_path(self, dataset_path: str) -> str:
-        """Get cache file path for dataset with better handling"""
+        """Get the cache path prefix for dataset with better handling
+
+        The feature store is a set of files sharing this prefix:
+            <prefix>.json            header (counts, scaler mean/scale, known failures)
+            <prefix>.features.f32    raw float32 feature matrix, memory-mappable
+            <prefix>.paths.bin       NUL-separated UTF-8 file path table
+            <prefix>.fingerprints.i64  raw int64 (size, mtime/hash) pair per file
+        """
         # Use absolute path for more reliable caching
         abs_path = os.path.abspath(dataset_path)
         # Use a more stable identifier for the cache file
         # We'll use just the last directory name since we know it's stable
         dir_name = os.path.basename(abs_path)
         # Use a simple deterministic string instead of hash
-        cache_file = f'stable_dataset_cache_{dir_name}.pkl'
-        cache_path = os.path.join(self.cache_dir, cache_file)
-        self.logger.info(f"Cache path: {cache_path}")
-        return cache_path
+        cache_prefix = os.path.join(self.cache_dir, f'feature_store_{dir_name}')
+        self.logger.info(f"Cache path: {cache_prefix}.json")
+        return cache_prefix
+
+    def _fingerprint(self, path: str) -> Tuple[int, int]:
+        """Fingerprint a file so changed files can be detected between runs"""
+        stat = os.stat(path)
+        if self.fingerprint_mode == 'content':
+            with open(path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).digest()
+            return (stat.st_size, int.from_bytes(digest[:8], 'little', signed=True))
+        return (stat.st_size, stat.st_mtime_ns)
 
     def _save_to_cache(self, dataset_path: str):
-        """Save processed data to cache"""
+        """Save processed data to the on-disk feature store"""
         self._ensure_cache_dir()
-        cache_path = self._get_cache_path(dataset_path)
-        
-        cache_data = {
-            'file_paths': self.file_paths,
-            'feature_matrix': self.feature_matrix,
-            'scaler': self.scaler
+        prefix = self._get_cache_path(dataset_path)
+        dimension = len(DEFAULT_FEATURE_WEIGHTS)
+        has_scaler = hasattr(self.scaler, 'mean_')
+
+        header = {
+            'version': CACHE_VERSION,
+            'fingerprint_mode': self.fingerprint_mode,
+            'feature_names': list(DEFAULT_FEATURE_WEIGHTS.keys()),
+            'feature_settings': self.calculator.settings(),
+            'count': len(self.file_paths),
+            'dimension': dimension,
+            'scaler': {
+                'mean': self.scaler.mean_.tolist(),
+                'var': self.scaler.var_.tolist(),
+                'scale': self.scaler.scale_.tolist(),
+                'n_samples_seen': int(self.scaler.n_samples_seen_)
+            } if has_scaler else None,
+            'failed_files': [[path, *fp] for path, fp in self.failed_files.items()]
         }
-        
+        payloads = {
+            '.features.f32': np.ascontiguousarray(self.feature_matrix, dtype='<f4').reshape(-1, dimension).tobytes(),
+            '.paths.bin': '\0'.join(self.file_paths).encode('utf-8'),
+            '.fingerprints.i64': np.array(self.fingerprints, dtype='<i8').reshape(-1, 2).tobytes()
+        }
+        # Digest of everything the index is derived from; a persisted index is
+        # only reused when it was built against the same digest
+        digest = hashlib.sha1(json.dumps(header, sort_keys=True).encode('utf-8'))
+        for payload in payloads.values():
+            digest.update(payload)
+        header['digest'] = digest.hexdigest()
+        payloads['.json'] = json.dumps(header).encode('utf-8')
+        self.cache_digest = None
+
         try:
-            with open(cache_path, 'wb') as f:
-                pickle.dump(cache_data, f)
-            self.logger.info(f"Saved dataset cache to: {cache_path}")
+            # Write every part to a temporary file first, then swap them in with the
+            # header last, so readers never see a header pointing at partial data.
+            # Processes that already mapped the old matrix keep their (unlinked) copy.
+            for suffix, payload in payloads.items():
+                with open(prefix + suffix + '.tmp', 'wb') as f:
+                    f.write(payload)
+            for suffix in payloads:
+                os.replace(prefix + suffix + '.tmp', prefix + suffix)
+            self.cache_digest = header['digest']
+            self.logger.info(f"Saved dataset cache to: {prefix}.*")
         except Exception as e:
             self.logger.error(f"Failed to save cache: {str(e)}")
 
     def _load_from_cache(self, dataset_path: str) -> bool:
-        """Load processed data from cache if available"""
-        cache_path = self._get_cache_path(dataset_path)
+        """Map the on-disk feature store if available
+
+        The feature matrix is opened with np.memmap, so its pages are loaded lazily
+        and shared between processes through the OS page cache.
+        """
+        prefix = self._get_cache_path(dataset_path)
         
-        if not os.path.exists(cache_path):
+        if not os.path.exists(prefix + '.json'):
             self.logger.info("No cache file found")
             return False
             
         try:
-            self.logger.info(f"Attempting to load cache from: {cache_path}")
-            with open(cache_path, 'rb') as f:
-                cache_data = pickle.load(f)
-                
-            self.file_paths = cache_data['file_paths']
-            self.feature_matrix = cache_data['feature_matrix']
-            self.scaler = cache_data['scaler']
-            
+            self.logger.info(f"Attempting to load cache from: {prefix}.json")
+            with open(prefix + '.json', 'r', encoding='utf-8') as f:
+                header = json.load(f)
+
+            if (header.get('version') != CACHE_VERSION
+                    or header.get('fingerprint_mode') != self.fingerprint_mode
+                    or header.get('feature_names') != list(DEFAULT_FEATURE_WEIGHTS.keys())
+                    or header.get('feature_settings') != self.calculator.settings()):
+                self.logger.warning("Cache format, feature settings or fingerprint mode changed, ignoring cache")
+                return False
+
+            count = header['count']
+            dimension = header['dimension']
+
             # Basic cache validation
-            if len(self.file_paths) == 0 or self.feature_matrix is None:
+            if os.path.getsize(prefix + '.features.f32') != count * dimension * 4 \
+                    or os.path.getsize(prefix + '.fingerprints.i64') != count * 16:
                 self.logger.warning("Cache data is invalid")
                 return False
 
-            # Verify at least one file still exists (basic integrity check)
-            if not any(os.path.exists(path) for path in self.file_paths[:5]):
-                self.logger.warning("Cache validation failed - files no longer exist")
+            with open(prefix + '.paths.bin', 'rb') as f:
+                path_blob = f.read()
+            file_paths = path_blob.decode('utf-8').split('\0') if count > 0 else []
+            if len(file_paths) != count:
+                self.logger.warning("Cache data is invalid")
                 return False
-                
+
+            if count > 0:
+                feature_matrix = np.memmap(prefix + '.features.f32', dtype='<f4', mode='r',
+                                           shape=(count, dimension))
+            else:
+                feature_matrix = np.empty((0, dimension), dtype='float32')
+            fingerprints = np.fromfile(prefix + '.fingerprints.i64', dtype='<i8').reshape(-1, 2)
+
+            self.file_paths = file_paths
+            self.fingerprints = list(map(tuple, fingerprints.tolist()))
+            self.failed_files = {entry[0]: tuple(entry[1:]) for entry in header['failed_files']}
+            self.feature_matrix = feature_matrix
+            self.scaler = self._scaler_from_header(header['scaler'])
+            self.cache_digest = header.get('digest')
             self.logger.info(f"Successfully loaded {len(self.file_paths)} files from cache")
             return True
         except Exception as e:
             self.logger.error(f"Failed to load cache: {str(e)}")
             return False
+
+    def _scaler_from_header(self, params: Optional[Dict]) -> StandardScaler:
+        """Rebuild a fitted StandardScaler from the parameters stored in the header"""
+        scaler = StandardScaler()
+        if params is not None:
+            scaler.mean_ = np.array(params['mean'], dtype='float64')
+            scaler.var_ = np.array(params['var'], dtype='float64')
+            scaler.scale_ = np.array(params['scale'], dtype='float64')
+            scaler.n_samples_seen_ = params['n_samples_seen']
+            scaler.n_features_in_ = len(scaler.mean_)
+        return scaler
+
+    def _sync_with_dataset(self, midi_paths: List[str]) -> bool:
+        """Bring the loaded (or empty) cache in line with the files on disk
+
+        Unchanged files keep their cached feature rows, deleted files are dropped
+        and only added or modified files are re-extracted. Rows of files that are
+        kept stay in their previous order; new rows are appended in scan order.
+
+        Returns:
+            True if anything changed and the cache needs to be rewritten
+        """
+        current = {}
+        for path in midi_paths:
+            try:
+                current[path] = self._fingerprint(path)
+            except OSError as e:
+                self.logger.warning(f"Cannot stat {path}: {str(e)}")
+
+        keep_rows = [i for i, path in enumerate(self.file_paths)
+                     if current.get(path) == self.fingerprints[i]]
+        known = {self.file_paths[i] for i in keep_rows}
+        known.update(path for path, fp in self.failed_files.items() if current.get(path) == fp)
+        to_extract = [path for path in current if path not in known]
+        removed = len(self.file_paths) - len(keep_rows)
+        failed_files = {path: fp for path, fp in self.failed_files.items()
+                        if current.get(path) == fp}
+        changed = bool(to_extract) or removed > 0 or len(failed_files) != len(self.failed_files)
+
+        self.logger.info(f"Dataset sync: {len(keep_rows)} cached, {len(to_extract)} new or modified, "
+                         f"{removed} removed or modified, {len(failed_files)} known failures")
+        if not changed:
+            return False
+
+        features, paths, failed = self._process_files(to_extract) if to_extract else ([], [], [])
+
+        dimension = len(DEFAULT_FEATURE_WEIGHTS)
+        kept_matrix = (self.feature_matrix[keep_rows] if self.feature_matrix is not None
+                       else np.empty((0, dimension), dtype='float32'))
+        new_matrix = np.array(features, dtype='float32').reshape(-1, dimension)
+        self.feature_matrix = np.vstack([kept_matrix, new_matrix])
+        self.fingerprints = [self.fingerprints[i] for i in keep_rows] + [current[p] for p in paths]
+        self.file_paths = [self.file_paths[i] for i in keep_rows] + paths
+        failed_files.update((path, current[path]) for path in failed)
+        self.failed_files = failed_files
+        return True
         
     def initialize(self, dataset_path: str = DATASET_PATH) -> None:
         """Preprocess and index entire dataset"""
         self.logger.info(f"Initializing database from: {dataset_path}")
+        self.dataset_path = dataset_path
 
         # Check if dataset path exists
         if not os.path.exists(dataset_path):
@@ -109,136 +293,478 @@ class MIDIDatabase:
             self._initialize_empty_database()
             return
 
-        # First try to load from cache
-        if self._load_from_cache(dataset_path):
-            self.logger.info(f"Successfully loaded dataset from cache with {len(self.file_paths)} files")
+        # Start from the cache when available; only the difference is processed
+        if not self._load_from_cache(dataset_path):
+            self._reset_cache_state()
+
+        total_midi_files = self._scan_midi_files(dataset_path)
+        self.logger.info(f"Found {len(total_midi_files)} MIDI files in dataset")
+
+        if self._sync_with_dataset(total_midi_files):
             if len(self.file_paths) > 0:
-                # Create FAISS index from cached data
-                dimension = len(DEFAULT_FEATURE_WEIGHTS)
-                self.index = faiss.IndexFlatL2(dimension)
-                scaled_features = self.scaler.transform(self.feature_matrix)
-                self.index.add(scaled_features.astype('float32'))
-                self.logger.info("Successfully initialized index from cache")
-                return
+                self.logger.info("Fitting StandardScaler...")
+                self.scaler = StandardScaler()
+                self.scaler.fit(self.feature_matrix)
+            self._save_to_cache(dataset_path)
+        self._build_path_index()
+
+        if len(self.file_paths) == 0:
+            if not total_midi_files:
+                self.logger.warning(f"No MIDI files found in {dataset_path} or its subdirectories")
             else:
-                self.logger.warning("Cache was empty, will scan for new files")
-        
-        # If no cache or empty cache, check for MIDI files in all subdirectories
-        total_midi_files = []
-        for root, _, files in os.walk(dataset_path):
-            midi_files = [os.path.join(root, f) for f in files if f.lower().endswith(('.mid', '.midi'))]
-            total_midi_files.extend(midi_files)
-        
-        if not total_midi_files:
-            self.logger.warning(f"No MIDI files found in {dataset_path} or its subdirectories")
+                self.logger.warning("No valid MIDI files could be processed")
             self._initialize_empty_database()
             return
-        
-        self.logger.info(f"Found {len(total_midi_files)} MIDI files in dataset")
-        
-        # Process dataset
-        self.logger.info("Processing dataset (this may take a while)...")
-        features, paths = self._process_dataset(dataset_path)
-        
-        if len(features) == 0:
-            self.logger.warning("No valid MIDI files could be processed")
-            self._initialize_empty_database()
-        else:
-            self.logger.info(f"Successfully processed {len(features)} MIDI files")
-            self.file_paths = paths
-            self.feature_matrix = np.array(features, dtype='float32')
-            self.logger.info("Fitting StandardScaler...")
-            self.scaler.fit(self.feature_matrix)
-            
-            # Save processed data to cache
-            self._save_to_cache(dataset_path)
-            
-            # Create FAISS index
-            dimension = len(DEFAULT_FEATURE_WEIGHTS)
-            self.logger.info(f"Creating FAISS index with dimension {dimension}")
-            self.index = faiss.IndexFlatL2(dimension)
-            scaled_features = self.scaler.transform(self.feature_matrix)
-            self.index.add(scaled_features.astype('float32'))
-            
+
+        # Create FAISS index, unless one built from exactly these features was
+        # persisted, in which case warm starts skip scaling and index construction
+        if not self._load_index(dataset_path):
+            self._build_index()
+            self._save_index(dataset_path)
         self.logger.info("Database initialization complete")
 
+    def _index_params(self) -> Dict:
+        """Parameters that determine the structure of the index"""
+        if self.index_type == 'ivf':
+            return {'type': 'ivf', 'nlist': IVF_NLIST}
+        if self.index_type == 'hnsw':
+            return {'type': 'hnsw', 'M': HNSW_M, 'ef_construction': HNSW_EF_CONSTRUCTION}
+        return {'type': 'flat'}
+
+    def _create_index(self, n_vectors: int):
+        """Create an empty FAISS index of the configured type
+
+        'flat' and 'ivf' search the [z, z^2] rows by inner product. HNSW graphs
+        navigate poorly under inner product, so 'hnsw' indexes the same rows
+        extended by one dimension, sqrt(max_norm^2 - ||row||^2), which turns the
+        maximum inner product search into a plain L2 nearest neighbour search
+        (queries get a 0 in that dimension).
+        """
+        dimension = 2 * len(DEFAULT_FEATURE_WEIGHTS)
+        if self.index_type == 'ivf':
+            # faiss needs ~39 training points per list, keep small libraries trainable
+            nlist = max(1, min(IVF_NLIST, n_vectors // 39))
+            quantizer = faiss.IndexFlatIP(dimension)
+            return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        if self.index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dimension + 1, HNSW_M)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            return index
+        if self.index_type != 'flat':
+            self.logger.warning(f"Unknown index type '{self.index_type}', using flat index")
+            self.index_type = 'flat'
+        return faiss.IndexFlatIP(dimension)
+
+    def _apply_search_params(self):
+        """Apply query-time parameters, which can change without retraining"""
+        if self.index_type == 'ivf':
+            self.index.nprobe = min(IVF_NPROBE, self.index.nlist)
+        elif self.index_type == 'hnsw':
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    def _index_vectors(self, scaled_features: np.ndarray) -> np.ndarray:
+        """Convert standardized rows to the vectors stored in the index"""
+        vectors = np.hstack([scaled_features, scaled_features ** 2]).astype('float32')
+        if self.index_type != 'hnsw':
+            return vectors
+        norms = np.sum(vectors.astype('float64') ** 2, axis=1)
+        extra = np.sqrt(norms.max() - norms).astype('float32').reshape(-1, 1)
+        return np.hstack([vectors, extra])
+
+    def _query_vectors(self, scaled_queries: np.ndarray, weight_vector: np.ndarray) -> np.ndarray:
+        """Fold weights into standardized queries to match _index_vectors"""
+        squared_weights = weight_vector ** 2
+        queries = np.hstack([2 * squared_weights * scaled_queries,
+                             np.tile(-squared_weights, (len(scaled_queries), 1))])
+        if self.index_type == 'hnsw':
+            queries = np.hstack([queries, np.zeros((len(queries), 1))])
+        return queries.astype('float32')
+
+    def _build_index(self):
+        """Build the search index over the standardized features
+
+        Weighted L2 distance between standardized vectors z_i and z_q is
+            sum(w^2 * z_i^2) - 2 * sum(w^2 * z_i * z_q) + sum(w^2 * z_q^2)
+        so each row is stored as [z_i, z_i^2] and the weights are folded into
+        the query as [2 * w^2 * z_q, -w^2] at search time, which makes the
+        nearest row the one with the largest inner product. The index is
+        therefore built once and reused for every weight profile.
+        """
+        n_vectors = len(self.file_paths)
+        self.logger.info(f"Creating {self.index_type} FAISS index for {n_vectors} files")
+        self.index = self._create_index(n_vectors)
+        if n_vectors > 0:
+            vectors = self._index_vectors(self.scaler.transform(self.feature_matrix))
+            if not self.index.is_trained:
+                self.logger.info("Training index...")
+                self.index.train(vectors)
+            self.index.add(vectors)
+        self._apply_search_params()
+
+    def _get_index_path(self, dataset_path: str) -> str:
+        """Get the index file path, stored next to the feature store"""
+        return f'{self._get_cache_path(dataset_path)}.{self.index_type}.faiss'
+
+    def _save_index(self, dataset_path: str):
+        """Persist the trained and populated index with its build parameters"""
+        if self.cache_digest is None:
+            self.logger.warning("Feature store was not saved, not persisting index")
+            return
+        self._ensure_cache_dir()
+        index_path = self._get_index_path(dataset_path)
+        meta = {
+            'params': self._index_params(),
+            'count': len(self.file_paths),
+            'digest': self.cache_digest
+        }
+        try:
+            faiss.write_index(self.index, index_path + '.tmp')
+            os.replace(index_path + '.tmp', index_path)
+            with open(index_path + '.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            self.logger.info(f"Saved index to: {index_path}")
+        except Exception as e:
+            self.logger.error(f"Failed to save index: {str(e)}")
+
+    def _load_index(self, dataset_path: str) -> bool:
+        """Load a persisted index built from the current features and parameters
+
+        The index is memory-mapped when the faiss build supports it, so its
+        pages are shared between processes like the feature matrix.
+        """
+        if self.cache_digest is None:
+            return False
+        index_path = self._get_index_path(dataset_path)
+        if not os.path.exists(index_path) or not os.path.exists(index_path + '.json'):
+            return False
+        try:
+            with open(index_path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta['params'] != self._index_params() or meta['count'] != len(self.file_paths)
+                    or meta.get('digest') != self.cache_digest):
+                self.logger.info("Persisted index is stale, rebuilding")
+                return False
+            index = self._read_index(index_path)
+            if index.ntotal != len(self.file_paths):
+                return False
+            self.index = index
+            self._apply_search_params()
+            self.logger.info(f"Loaded {self.index_type} index from: {index_path}")
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to load index: {str(e)}")
+            return False
+
+    def _read_index(self, index_path: str):
+        """Read an index, memory-mapped when possible"""
+        mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', getattr(faiss, 'IO_FLAG_MMAP', None))
+        if mmap_flag is not None:
+            try:
+                return faiss.read_index(index_path, mmap_flag)
+            except RuntimeError as e:
+                self.logger.info(f"Memory-mapped index load not supported, reading into memory: {str(e)}")
+        return faiss.read_index(index_path)
+
+    def evaluate_index(self, k: int = 10, n_queries: int = 200, weights: Optional[Dict] = None) -> Dict:
+        """Measure recall@k and query latency of the index against exact search
+
+        Queries are drawn from the indexed patterns themselves. The exact
+        baseline is a flat inner-product index over the same rows.
+
+        Returns:
+            Dict with index_type, k, n_queries, recall, ms_per_query and flat_ms_per_query
+        """
+        n_vectors = len(self.file_paths)
+        if n_vectors == 0:
+            return {}
+        k = min(k, n_vectors)
+        weight_vector = self._weight_vector(weights or DEFAULT_FEATURE_WEIGHTS)
+        scaled_features = self.scaler.transform(self.feature_matrix)
+
+        rng = np.random.default_rng(0)
+        rows = rng.choice(n_vectors, size=min(n_queries, n_vectors), replace=False)
+        queries = self._query_vectors(scaled_features[rows], weight_vector)
+
+        flat = faiss.IndexFlatIP(2 * len(DEFAULT_FEATURE_WEIGHTS))
+        flat.add(np.hstack([scaled_features, scaled_features ** 2]).astype('float32'))
+        start = time.perf_counter()
+        _, expected = flat.search(np.ascontiguousarray(queries[:, :flat.d]), k)
+        flat_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = self.index.search(queries, k)
+        index_time = time.perf_counter() - start
+
+        recall = np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)])
+        report = {
+            'index_type': self.index_type,
+            'k': k,
+            'n_queries': len(rows),
+            'recall': float(recall),
+            'ms_per_query': 1000 * index_time / len(rows),
+            'flat_ms_per_query': 1000 * flat_time / len(rows)
+        }
+        self.logger.info(f"Index report: {report}")
+        return report
+
+    def _reset_cache_state(self):
+        """Forget any loaded cache contents before a full scan"""
+        self.file_paths = []
+        self.fingerprints = []
+        self.failed_files = {}
+        self.feature_matrix = None
+        self.scaler = StandardScaler()
+        self.cache_digest = None
+
     def _initialize_empty_database(self):
         """Initialize an empty database with proper structure"""
         self.file_paths = []
+        self.fingerprints = []
         self.feature_matrix = np.array([], dtype='float32').reshape(0, len(DEFAULT_FEATURE_WEIGHTS))
-        self.index = faiss.IndexFlatL2(len(DEFAULT_FEATURE_WEIGHTS))
+        self.index = self._create_index(0)
+        self._build_path_index()
         self.logger.info("Initialized empty database - ready for new files")
 
+    def _build_path_index(self):
+        """Map paths and file names to ids so results resolve without touching the disk
+
+        A file's id is its row in file_paths, which is persisted with the
+        feature store, so ids stay valid for as long as the loaded database.
+        """
+        self.path_ids = {}
+        self.basename_ids = {}
+        for file_id, path in enumerate(self.file_paths):
+            path = os.path.normpath(path)
+            self.path_ids[path] = file_id
+            self.basename_ids.setdefault(os.path.basename(path), file_id)
+
+    def path_for_id(self, file_id: int) -> Optional[str]:
+        """Dataset path of a file id, or None if there is no such file"""
+        if 0 <= file_id < len(self.file_paths):
+            return self.file_paths[file_id]
+        return None
+
+    def resolve_path(self, path: str) -> Optional[int]:
+        """Find the id of a dataset file from a full, dataset-relative or bare file name
+
+        Full paths are tried first, then the path relative to the dataset
+        directory, then the file name alone.
+
+        Returns:
+            File id or None if the file is not in the database
+        """
+        candidates = [path, os.path.join(self.dataset_path, path)]
+        if os.path.isabs(path):
+            candidates.append(os.path.relpath(path))
+        for candidate in candidates:
+            file_id = self.path_ids.get(os.path.normpath(candidate))
+            if file_id is not None:
+                return file_id
+        return self.basename_ids.get(os.path.basename(path))
+
+    def _scan_midi_files(self, dataset_path: str) -> List[str]:
+        """Collect all MIDI file paths under dataset_path in walk order"""
+        midi_paths = []
+        for root, _, files in os.walk(dataset_path):
+            midi_paths.extend(os.path.join(root, f) for f in files
+                              if f.lower().endswith(('.mid', '.midi')))
+        return midi_paths
+
     def _process_dataset(self, dataset_path: str) -> Tuple[List, List]:
+        self.logger.info("Starting dataset processing...")
+        features, paths, _ = self._process_files(self._scan_midi_files(dataset_path))
+        return features, paths
+
+    def _process_files(self, midi_paths: List[str]) -> Tuple[List, List, List]:
+        """Extract feature vectors for the given files, keeping input order
+
+        Returns:
+            (features, paths, failed_paths) where failed files produced no features
+        """
         features = []
         paths = []
-        
-        self.logger.info("Starting dataset processing...")
-        total_files = 0
+        failed = []
+        total_files = len(midi_paths)
         processed_files = 0
-        
-        for root, _, files in os.walk(dataset_path):
-            midi_files = [f for f in files if f.lower().endswith(('.mid', '.midi'))]
-            total_files += len(midi_files)
-            
-            for file in midi_files:
-                path = os.path.join(root, file)
+        done_files = 0
+        start = time.time()
+
+        for path, feat, error in self._iter_extracted(midi_paths):
+            done_files += 1
+            if error is not None:
+                self.logger.error(f"Error processing {path}: {error}")
+                failed.append(path)
+            elif feat is None:
+                self.logger.warning(f"No features extracted from: {path}")
+                failed.append(path)
+            else:
+                feat_vector = self._feature_vector(feat)
+                if len(feat_vector) == len(DEFAULT_FEATURE_WEIGHTS):
+                    features.append(feat_vector)
+                    paths.append(path)
+                    processed_files += 1
+                else:
+                    failed.append(path)
+
+            if done_files % max(10, self.chunk_size) == 0 or done_files == total_files:
+                self._report_progress(done_files, total_files, start)
+
+        self.logger.info(f"Dataset processing complete. Successfully processed {processed_files}/{total_files} files")
+        return features, paths, failed
+
+    def _iter_extracted(self, midi_paths: List[str]):
+        """Yield (path, features, error) for each file in input order
+
+        Uses a process pool when more than one worker is configured and there is
+        more than one chunk of work, otherwise extracts in the current process.
+        """
+        chunks = [midi_paths[i:i + self.chunk_size]
+                  for i in range(0, len(midi_paths), self.chunk_size)]
+        workers = min(self.workers, len(chunks))
+
+        if workers <= 1:
+            for path in midi_paths:
                 try:
                     self.logger.debug(f"Processing: {path}")
-                    feat = self.calculator.extract_features(path)
-                    if feat is not None:
-                        feat_vector = self._feature_vector(feat)
-                        if len(feat_vector) == len(DEFAULT_FEATURE_WEIGHTS):
-                            features.append(feat_vector)
-                            paths.append(path)
-                            processed_files += 1
-                            if processed_files % 10 == 0:  # Log progress every 10 files
-                                self.logger.info(f"Processed {processed_files}/{total_files} files")
-                    else:
-                        self.logger.warning(f"No features extracted from: {path}")
+                    yield path, self.calculator.extract_features(path), None
                 except Exception as e:
-                    self.logger.error(f"Error processing {path}: {str(e)}")
-                    continue
-        
-        self.logger.info(f"Dataset processing complete. Successfully processed {processed_files}/{total_files} files")
-        return features, paths
+                    yield path, None, str(e)
+            return
+
+        self.logger.info(f"Extracting features with {workers} worker processes "
+                         f"({len(chunks)} chunks of up to {self.chunk_size} files)")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_ingest_worker,
+                                 initargs=(dict(self.calculator.settings(),
+                                                engine=self.calculator.engine),)) as executor:
+            # map() yields chunk results in submission order, which keeps the
+            # merged file_paths/feature_matrix order deterministic
+            for chunk_results in executor.map(_extract_chunk, chunks):
+                yield from chunk_results
+
+    def _report_progress(self, done: int, total: int, start: float):
+        """Log ingestion progress and forward it to the progress callback"""
+        elapsed = time.time() - start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        self.logger.info(f"Processed {done}/{total} files ({rate:.1f} files/s)")
+        if self.progress_callback is not None:
+            try:
+                self.progress_callback(done, total)
+            except Exception as e:
+                self.logger.warning(f"Progress callback failed: {str(e)}")
 
     def _feature_vector(self, features: Dict) -> List[float]:
         """Convert feature dictionary to vector in correct order"""
         return [features.get(key, 0.0) for key in DEFAULT_FEATURE_WEIGHTS.keys()]
 
-    def find_similar(self, query_path: str, weights: Dict, k: int = MAX_RESULTS) -> List[Tuple[str, float]]:
-        """Find similar MIDI files with weighted features"""
-        self.logger.info(f"Searching for similar files to: {query_path}")
+    def query_vector(self, query_path: str) -> Optional[np.ndarray]:
+        """Extract the raw feature vector of a query file
+
+        The vector can be kept by the caller and passed to find_similar_vector
+        to search again with different weights without re-parsing the file.
+
+        Returns:
+            float32 vector in feature order, or None if extraction failed
+        """
         query_feats = self.calculator.extract_features(query_path)
         if query_feats is None:
             self.logger.error(f"Failed to extract features from query file: {query_path}")
+            return None
+        return np.array(self._feature_vector(query_feats), dtype='float32')
+
+    def find_similar(self, query_path: str, weights: Dict, k: int = MAX_RESULTS) -> List[Tuple[str, float]]:
+        """Find similar MIDI files with weighted features"""
+        self.logger.info(f"Searching for similar files to: {query_path}")
+        query_vector = self.query_vector(query_path)
+        if query_vector is None:
             return []
+        return self.find_similar_vector(query_vector, weights, k)
 
-        # Apply feature weights
-        self.logger.debug("Applying feature weights...")
-        weighted_query = np.array([query_feats.get(key, 0.0) * weights.get(key, 1.0)
-                                 for key in DEFAULT_FEATURE_WEIGHTS.keys()], dtype='float32')
-        weighted_db = self.feature_matrix * np.array([weights.get(key, 1.0) 
-                                                    for key in DEFAULT_FEATURE_WEIGHTS.keys()], dtype='float32')
+    def find_similar_vector(self, query_vector: np.ndarray, weights: Dict,
+                            k: int = MAX_RESULTS) -> List[Tuple[str, float]]:
+        """Find similar MIDI files for a precomputed raw feature vector
 
-        # Scale weighted features
-        self.logger.debug("Scaling features...")
-        scaled_query = self.scaler.transform(weighted_query.reshape(1, -1))
-        scaled_db = self.scaler.transform(weighted_db)
+        Args:
+            query_vector: Vector returned by query_vector
+            weights: Feature weights
+            k: Number of results
 
-        # Update index with current weights
-        self.logger.debug("Performing similarity search...")
-        temp_index = faiss.IndexFlatL2(scaled_db.shape[1])
-        temp_index.add(scaled_db.astype('float32'))
+        Returns:
+            List of (path, similarity) tuples, most similar first
+        """
+        if len(self.file_paths) == 0:
+            self.logger.warning("Database is empty, nothing to search")
+            return []
+
+        query_vector = np.asarray(query_vector, dtype='float32').reshape(1, -1)
+        results = self._search(query_vector, weights, k)[0]
 
-        # Perform search
-        k = min(k, len(self.file_paths))
-        distances, indices = temp_index.search(scaled_query.astype('float32'), k)
-        
-        results = [(self.file_paths[i], float(1/(1+d))) 
-                  for d, i in zip(distances[0], indices[0]) if i < len(self.file_paths)]
-        
         self.logger.info(f"Found {len(results)} similar files")
         return results
-        
\ No newline at end of file
+
+    def find_similar_batch(self, query_paths: List[str], weights: Dict,
+                           k: int = MAX_RESULTS) -> List[List[Tuple[str, float]]]:
+        """Find similar MIDI files for many queries with a single index search
+
+        Query features are extracted with the ingestion process pool and all
+        queries are searched together.
+
+        Returns:
+            One result list per query path, in input order; queries whose
+            features could not be extracted get an empty list
+        """
+        self.logger.info(f"Batch search for {len(query_paths)} query files")
+        results = [[] for _ in query_paths]
+        if len(self.file_paths) == 0 or not query_paths:
+            return results
+
+        rows = []
+        query_vectors = []
+        for row, (path, feat, error) in enumerate(self._iter_extracted(list(query_paths))):
+            if error is not None or feat is None:
+                self.logger.error(f"Failed to extract features from query file: {path}")
+                continue
+            rows.append(row)
+            query_vectors.append(self._feature_vector(feat))
+
+        if rows:
+            batch_results = self._search(np.array(query_vectors, dtype='float32'), weights, k)
+            for row, row_results in zip(rows, batch_results):
+                results[row] = row_results
+
+        self.logger.info(f"Batch search complete for {len(rows)}/{len(query_paths)} queries")
+        return results
+
+    def _search(self, query_vectors: np.ndarray, weights: Dict, k: int) -> List[List[Tuple[str, float]]]:
+        """Search the index for a (n_queries, n_features) matrix of raw feature vectors"""
+        # Standardize the queries and fold the weights into them
+        self.logger.debug("Applying feature weights...")
+        mean, scale = self.scaler.mean_, self.scaler.scale_
+        scaled_queries = (np.asarray(query_vectors, dtype='float64') - mean) / scale
+        weight_vector = self._weight_vector(weights)
+        weighted_queries = self._query_vectors(scaled_queries, weight_vector)
+
+        # Perform search on the prebuilt index
+        self.logger.debug("Performing similarity search...")
+        n_files = len(self.file_paths)
+        k = min(k, n_files)
+        _, indices = self.index.search(weighted_queries, k)
+        valid = (indices >= 0) & (indices < n_files)
+        indices = np.where(valid, indices, 0)
+
+        # Recompute exact distances for the candidates; the expanded form used by
+        # the index loses precision for near-identical vectors
+        unique_rows, inverse = np.unique(indices, return_inverse=True)
+        scaled_rows = (np.asarray(self.feature_matrix[unique_rows], dtype='float64') - mean) / scale
+        candidates = scaled_rows[inverse.reshape(indices.shape)]
+        distances = np.sum(((candidates - scaled_queries[:, None, :]) * weight_vector) ** 2, axis=2)
+        distances[~valid] = np.inf
+        order = np.argsort(distances, axis=1, kind='stable')
+
+        return [[(self.file_paths[indices[q, j]], float(1/(1+distances[q, j])))
+                 for j in order[q] if valid[q, j]]
+                for q in range(len(indices))]
+
+    def _weight_vector(self, weights: Dict) -> np.ndarray:
+        """Convert a weight dictionary to a vector in feature order"""
+        return np.array([float(weights.get(key, 1.0)) for key in DEFAULT_FEATURE_WEIGHTS.keys()],
+                        dtype='float64')
@@ -1,12 +1,39 @@
 import logging
 import numpy as np
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 from pretty_midi import PrettyMIDI
+from config import FEATURE_ENGINE, TEMPO_STRATEGY, TEMPO_WINDOW_ONSETS
+from midi_reader import NoteArrays, read_note_arrays, estimate_tempo
+
+TEMPO_STRATEGIES = ('full', 'window', 'header')
 
 class FeatureCalculator:
-    def __init__(self):
+    def __init__(self, engine: str = FEATURE_ENGINE, tempo_strategy: str = TEMPO_STRATEGY,
+                 tempo_window: int = TEMPO_WINDOW_ONSETS):
+        """
+        Args:
+            engine: 'raw' to parse MIDI bytes straight into note arrays,
+                'pretty_midi' to go through a full PrettyMIDI object
+            tempo_strategy: 'full' estimates tempo from all onsets, 'window' from
+                the first tempo_window onsets, 'header' reads the file's tempo map
+            tempo_window: Number of onsets used by the 'window' strategy
+        """
+        if tempo_strategy not in TEMPO_STRATEGIES:
+            raise ValueError(f"Unknown tempo strategy '{tempo_strategy}', expected one of {TEMPO_STRATEGIES}")
         self.required_notes = 2  # Minimum notes to process
+        self.engine = engine
+        self.tempo_strategy = tempo_strategy
+        self.tempo_window = tempo_window
         self._setup_logging()
+
+    def settings(self) -> Dict:
+        """Settings that change the extracted features
+
+        Stored with cached features so a cache built with different settings
+        is not mixed with new extractions. The engine is not included because
+        both engines produce identical features.
+        """
+        return {'tempo_strategy': self.tempo_strategy, 'tempo_window': self.tempo_window}
         
     def _setup_logging(self):
         """Setup logging configuration"""
@@ -16,7 +43,7 @@ class FeatureCalculator:
         """Extract features from a MIDI file"""
         try:
             self.logger.debug(f"Loading MIDI file: {file_path}")
-            midi = PrettyMIDI(file_path)
+            notes = self._load_notes(file_path)
         except Exception as e:
             self.logger.error(f"Error loading MIDI file {file_path}: {str(e)}")
             return None
@@ -36,21 +63,20 @@ class FeatureCalculator:
 
         # Collect all notes from non-drum instruments
         self.logger.debug("Collecting notes from non-drum instruments")
-        all_notes = []
-        for instrument in midi.instruments:
-            if not instrument.is_drum:
-                all_notes.extend(instrument.notes)
+        melodic = ~notes.is_drum
+        n_notes = int(np.count_nonzero(melodic))
                 
-        if len(all_notes) < self.required_notes:
-            self.logger.warning(f"Insufficient notes in file (found {len(all_notes)}, required {self.required_notes})")
+        if n_notes < self.required_notes:
+            self.logger.warning(f"Insufficient notes in file (found {n_notes}, required {self.required_notes})")
             return None
 
-        self.logger.debug(f"Processing {len(all_notes)} notes")
+        self.logger.debug(f"Processing {n_notes} notes")
 
         # Basic features
-        features['tempo'] = self._get_tempo(midi)
-        pitches = [note.pitch for note in all_notes]
-        durations = [note.end - note.start for note in all_notes]
+        features['tempo'] = self._get_tempo(notes)
+        pitches = notes.pitch[melodic]
+        onsets = notes.onset[melodic]
+        durations = notes.offset[melodic] - onsets
         
         # Pitch statistics
         self.logger.debug("Calculating pitch statistics")
@@ -62,13 +88,13 @@ class FeatureCalculator:
         
         # Rhythm features
         self.logger.debug("Calculating rhythm features")
-        rhythm_features = self._calculate_rhythm_features(all_notes, features['tempo'])
+        rhythm_features = self._calculate_rhythm_features(onsets, features['tempo'])
         features.update(rhythm_features)
         
         # Interval features
         self.logger.debug("Calculating interval features")
         intervals = self._calculate_intervals(pitches)
-        features['interval_std'] = np.std(intervals) if intervals else 0.0
+        features['interval_std'] = np.std(intervals) if intervals.size > 0 else 0.0
         
         # Contour analysis
         self.logger.debug("Calculating contour features")
@@ -77,49 +103,73 @@ class FeatureCalculator:
         self.logger.debug("Feature extraction complete")
         return features
 
-    def _get_tempo(self, midi: PrettyMIDI) -> float:
-        try:
-            return midi.estimate_tempo()
-        except ValueError:
-            self.logger.warning("Could not estimate tempo, using tempo changes")
-            tempo_changes = midi.get_tempo_changes()
-            return tempo_changes[1][0] if len(tempo_changes[1]) > 0 else 120.0
+    def _load_notes(self, file_path: str) -> NoteArrays:
+        """Load all notes of a file (drums included) with the configured engine"""
+        if self.engine == 'raw':
+            return read_note_arrays(file_path)
+
+        midi = PrettyMIDI(file_path)
+        all_notes = [(note, instrument.is_drum)
+                     for instrument in midi.instruments for note in instrument.notes]
+        tempo_change_times, tempi = midi.get_tempo_changes()
+        return NoteArrays(
+            pitch=np.array([note.pitch for note, _ in all_notes], dtype=np.int64),
+            onset=np.array([note.start for note, _ in all_notes], dtype=np.float64),
+            offset=np.array([note.end for note, _ in all_notes], dtype=np.float64),
+            velocity=np.array([note.velocity for note, _ in all_notes], dtype=np.int64),
+            is_drum=np.array([is_drum for _, is_drum in all_notes], dtype=bool),
+            tempo_change_times=tempo_change_times,
+            tempi=tempi,
+            resolution=midi.resolution
+        )
+
+    def _get_tempo(self, notes: NoteArrays) -> float:
+        if self.tempo_strategy != 'header':
+            # Like PrettyMIDI.estimate_tempo, onsets of all instruments count
+            onsets = np.sort(notes.onset)
+            if self.tempo_strategy == 'window':
+                onsets = onsets[:self.tempo_window]
+            try:
+                return estimate_tempo(onsets)
+            except ValueError:
+                self.logger.warning("Could not estimate tempo, using tempo changes")
+        return notes.tempi[0] if len(notes.tempi) > 0 else 120.0
 
-    def _calculate_statistics(self, values: List[float], prefix: str) -> Dict:
-        if not values:
+    def _calculate_statistics(self, values: np.ndarray, prefix: str) -> Dict:
+        if len(values) == 0:
             self.logger.warning(f"No values provided for {prefix} statistics")
             return {}
             
-        arr = np.array(values)
+        arr = np.asarray(values)
         return {
             f'{prefix}_mean': float(np.mean(arr)),
             f'{prefix}_std': float(np.std(arr))
         }
 
-    def _calculate_rhythm_features(self, notes: List, tempo: float) -> Dict:
+    def _calculate_rhythm_features(self, onsets: np.ndarray, tempo: float) -> Dict:
         self.logger.debug("Calculating rhythm features")
-        onsets = sorted([note.start for note in notes])
-        iois = np.diff(onsets) if len(onsets) > 1 else []
+        onsets = np.sort(onsets)
+        iois = np.diff(onsets)
         
         # Syncopation calculation
         beat_duration = 60.0 / tempo
-        beat_positions = [(onset % (4 * beat_duration)) / beat_duration for onset in onsets]
-        syncopation = [1 if not np.isclose(pos % 1, 0, atol=0.1) else 0 for pos in beat_positions]
+        beat_positions = np.mod(onsets, 4 * beat_duration) / beat_duration
+        syncopation = ~np.isclose(np.mod(beat_positions, 1), 0, atol=0.1)
         
         return {
             'ioi_mean': float(np.mean(iois)) if iois.size > 0 else 0.0,
             'ioi_std': float(np.std(iois)) if iois.size > 0 else 0.0,
-            'syncopation_ratio': float(np.mean(syncopation)) if syncopation else 0.0
+            'syncopation_ratio': float(np.mean(syncopation)) if syncopation.size > 0 else 0.0
         }
 
-    def _calculate_intervals(self, pitches: List[int]) -> List[int]:
-        return [abs(pitches[i+1] - pitches[i]) 
-                for i in range(len(pitches)-1)] if len(pitches) > 1 else []
+    def _calculate_intervals(self, pitches: np.ndarray) -> np.ndarray:
+        return np.abs(np.diff(pitches))
 
-    def _calculate_contour_slope(self, pitches: List[int]) -> float:
+    def _calculate_contour_slope(self, pitches: np.ndarray) -> float:
         if len(pitches) < 2:
             return 0.0
             
-        ascents = sum(1 for i in range(len(pitches)-1) if pitches[i+1] > pitches[i])
-        descents = sum(1 for i in range(len(pitches)-1) if pitches[i+1] < pitches[i])
+        steps = np.sign(np.diff(pitches))
+        ascents = int(np.count_nonzero(steps > 0))
+        descents = int(np.count_nonzero(steps < 0))
         return (ascents - descents) / len(pitches)
\ No newline at end of file
@@ -0,0 +1,280 @@
+import struct
+import numpy as np
+from typing import NamedTuple
+
+# Largest tick accepted, same limit pretty_midi uses to reject corrupt files
+MAX_TICK = 1e7
+
+# Number of data bytes following each channel / system status byte
+_DATA_LENGTHS = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+_SYSTEM_DATA_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0,
+                        0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+
+class NoteArrays(NamedTuple):
+    """Notes of a MIDI file as parallel arrays
+
+    Notes are grouped by instrument in the order pretty_midi creates its
+    instruments, and within an instrument in the order they are closed, so
+    iterating the arrays visits notes exactly like iterating
+    PrettyMIDI.instruments[i].notes.
+    """
+    pitch: np.ndarray           # int64
+    onset: np.ndarray           # float64, seconds
+    offset: np.ndarray          # float64, seconds
+    velocity: np.ndarray        # int64
+    is_drum: np.ndarray         # bool
+    tempo_change_times: np.ndarray  # float64, seconds
+    tempi: np.ndarray           # float64, quarter notes per minute
+    resolution: int             # ticks per quarter note
+
+
+def _read_varlen(data: bytes, pos: int):
+    """Read a variable-length quantity, returns (value, new position)"""
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def read_note_arrays(file_path: str) -> NoteArrays:
+    """Parse a Standard MIDI File straight into note arrays
+
+    Mirrors how pretty_midi (via mido) reads a file: tempo changes come from
+    the first track only, note-offs close every open note of the same
+    channel/pitch started on an earlier tick, and notes are assigned to
+    (program, channel, track) instruments. No per-event or per-note Python
+    objects are created.
+
+    Args:
+        file_path: Path to the MIDI file
+
+    Returns:
+        NoteArrays for all notes in the file, drums included
+
+    Raises:
+        OSError, EOFError, ValueError, IndexError: If the file is not a readable MIDI file
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < 8:
+        raise EOFError
+    name, size = struct.unpack('>4sL', data[:8])
+    if name != b'MThd':
+        raise OSError('MThd not found. Probably not a MIDI file')
+    if len(data) < 8 + size or size < 6:
+        raise EOFError
+    _, num_tracks, resolution = struct.unpack('>hhh', data[8:14])
+    pos = 8 + size
+
+    # Per note: instrument index, pitch, start tick, end tick, velocity
+    note_instrument = []
+    note_pitch = []
+    note_start = []
+    note_end = []
+    note_velocity = []
+    instrument_map = {}  # (program, channel, track) -> instrument index, in creation order
+    instrument_is_drum = []
+    tempo_events = []  # (tick, microseconds per quarter) from the first track
+    max_tick = None
+
+    for track_idx in range(num_tracks):
+        if len(data) < pos + 8:
+            raise EOFError
+        name, size = struct.unpack('>4sL', data[pos:pos + 8])
+        if name != b'MTrk':
+            raise OSError('no MTrk header at start of track')
+        pos += 8
+        start = pos
+        tick = 0
+        last_status = None
+        track_events = 0
+        open_notes = {}
+        current_program = [0] * 16
+
+        while pos - start != size:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+            track_events += 1
+            status = data[pos]
+            pos += 1
+
+            if status < 0x80:
+                if last_status is None:
+                    raise OSError('running status without last_status')
+                pos -= 1  # Byte is the first data byte of a running-status message
+                status = last_status
+            elif status != 0xFF:
+                # Meta messages don't set running status
+                last_status = status
+
+            if status == 0xFF:
+                meta_type = data[pos]
+                length, pos = _read_varlen(data, pos + 1)
+                if pos + length > len(data):
+                    raise EOFError
+                if meta_type == 0x51 and track_idx == 0:
+                    if length < 3:
+                        raise ValueError('set_tempo message too short')
+                    tempo_events.append((tick, (data[pos] << 16) | (data[pos + 1] << 8) | data[pos + 2]))
+                pos += length
+                continue
+            if status == 0xF0 or status == 0xF7:
+                length, pos = _read_varlen(data, pos)
+                if pos + length > len(data):
+                    raise EOFError
+                # Sysex payload (without framing bytes) must be 7-bit like mido enforces
+                payload = data[pos:pos + length]
+                if payload[:1] == b'\xf0':
+                    payload = payload[1:]
+                if payload[-1:] == b'\xf7':
+                    payload = payload[:-1]
+                if payload and max(payload) > 127:
+                    raise ValueError('data byte must be in range 0..127')
+                pos += length
+                continue
+
+            kind = status >> 4
+            n_data = _DATA_LENGTHS.get(kind) if kind != 0xF else _SYSTEM_DATA_LENGTHS.get(status)
+            if n_data is None:
+                raise OSError(f'undefined status byte 0x{status:02x}')
+            if pos + n_data > len(data):
+                raise EOFError
+            if n_data and max(data[pos:pos + n_data]) > 127:
+                raise OSError('data byte must be in range 0..127')
+            channel = status & 0x0F
+
+            if kind == 0xC:
+                current_program[channel] = data[pos]
+            elif kind == 0x9 and data[pos + 1] > 0:
+                open_notes.setdefault((channel, data[pos]), []).append((tick, data[pos + 1]))
+            elif kind == 0x8 or kind == 0x9:
+                key = (channel, data[pos])
+                if key in open_notes:
+                    # One note-off closes every note started on an earlier tick;
+                    # a note-on on this very tick stays open
+                    open_for_key = open_notes[key]
+                    to_close = [note for note in open_for_key if note[0] != tick]
+                    to_keep = [note for note in open_for_key if note[0] == tick]
+                    if to_close:
+                        instrument_key = (current_program[channel], channel, track_idx)
+                        instrument = instrument_map.get(instrument_key)
+                        if instrument is None:
+                            instrument = len(instrument_is_drum)
+                            instrument_map[instrument_key] = instrument
+                            instrument_is_drum.append(channel == 9)
+                        for start_tick, velocity in to_close:
+                            note_instrument.append(instrument)
+                            note_pitch.append(data[pos])
+                            note_start.append(start_tick)
+                            note_end.append(tick)
+                            note_velocity.append(velocity)
+                    if to_close and to_keep:
+                        open_notes[key] = to_keep
+                    else:
+                        del open_notes[key]
+            pos += n_data
+
+        if track_events == 0:
+            raise ValueError('MIDI file contains an empty track')
+        max_tick = tick if max_tick is None else max(max_tick, tick)
+
+    if max_tick is None:
+        raise ValueError('MIDI file contains no tracks')
+    if max_tick + 1 > MAX_TICK:
+        raise ValueError(f'MIDI file has a largest tick of {max_tick + 1}, it is likely corrupt')
+
+    scale_ticks, scale_values = _tick_scales(tempo_events, resolution)
+    tick_to_time = _tick_to_time_function(scale_ticks, scale_values)
+
+    # Group notes by instrument creation order, keeping close order within each
+    order = np.argsort(np.array(note_instrument, dtype=np.int64), kind='stable')
+    instrument_is_drum = np.array(instrument_is_drum, dtype=bool)
+    note_instrument = np.array(note_instrument, dtype=np.int64)[order]
+    return NoteArrays(
+        pitch=np.array(note_pitch, dtype=np.int64)[order],
+        onset=tick_to_time(np.array(note_start, dtype=np.int64)[order]),
+        offset=tick_to_time(np.array(note_end, dtype=np.int64)[order]),
+        velocity=np.array(note_velocity, dtype=np.int64)[order],
+        is_drum=instrument_is_drum[note_instrument] if len(note_instrument) else np.zeros(0, dtype=bool),
+        tempo_change_times=tick_to_time(scale_ticks),
+        tempi=60.0 / (scale_values * resolution),
+        resolution=resolution
+    )
+
+
+def _tick_scales(tempo_events, resolution: int):
+    """Seconds-per-tick segments, built exactly like PrettyMIDI._tick_scales"""
+    tick_scales = [(0, 60.0 / (120.0 * resolution))]
+    for tick, tempo in tempo_events:
+        if tick == 0:
+            bpm = 6e7 / tempo
+            tick_scales = [(0, 60.0 / (bpm * resolution))]
+        else:
+            tick_scale = 60.0 / ((6e7 / tempo) * resolution)
+            # Ignore repetition of BPM, which happens often
+            if tick_scale != tick_scales[-1][1]:
+                tick_scales.append((tick, tick_scale))
+    ticks = np.array([tick for tick, _ in tick_scales], dtype=np.int64)
+    scales = np.array([scale for _, scale in tick_scales], dtype=np.float64)
+    return ticks, scales
+
+
+def _tick_to_time_function(scale_ticks: np.ndarray, scale_values: np.ndarray):
+    """Build a vectorized tick -> seconds mapping for the given tempo segments
+
+    Segment start times are accumulated in the same order of floating point
+    operations as pretty_midi's tick-to-time table, so results are identical.
+    """
+    segment_times = np.zeros(len(scale_ticks))
+    last_end_time = 0
+    for i in range(1, len(scale_ticks)):
+        last_end_time = last_end_time + scale_values[i - 1] * (scale_ticks[i] - scale_ticks[i - 1])
+        segment_times[i] = last_end_time
+
+    def tick_to_time(ticks: np.ndarray) -> np.ndarray:
+        segment = np.searchsorted(scale_ticks, ticks, side='right') - 1
+        return segment_times[segment] + scale_values[segment] * (ticks - scale_ticks[segment])
+
+    return tick_to_time
+
+
+def estimate_tempo(onsets: np.ndarray) -> float:
+    """Estimate a global tempo from sorted note onsets
+
+    Same inter-onset-interval clustering as PrettyMIDI.estimate_tempo
+    (Dixon 2001), operating on an onset array.
+
+    Raises:
+        ValueError: If no usable inter-onset intervals exist
+    """
+    ioi = np.diff(onsets)
+    # "Rhythmic information is provided by IOIs in the range of
+    # approximately 50ms to 2s (Handel, 1989)"
+    ioi = ioi[ioi > .05]
+    ioi = ioi[ioi < 2]
+    # Normalize all iois into the range 30...300bpm
+    for n in range(ioi.shape[0]):
+        while ioi[n] < .2:
+            ioi[n] *= 2
+    clusters = np.array([])
+    cluster_counts = np.array([])
+    for interval in ioi:
+        # If this ioi falls within a cluster (threshold is 25ms)
+        if (np.abs(clusters - interval) < .025).any():
+            k = np.argmin(clusters - interval)
+            clusters[k] = (cluster_counts[k]*clusters[k] + interval)/(cluster_counts[k] + 1)
+            cluster_counts[k] += 1
+        else:
+            clusters = np.append(clusters, interval)
+            cluster_counts = np.append(cluster_counts, 1.)
+    if clusters.size == 0:
+        raise ValueError("Can't provide a global tempo estimate when there"
+                         " are fewer than two notes.")
+    # Most populated cluster wins, ties resolved like pretty_midi's reversed argsort
+    cluster_sort = np.argsort(cluster_counts)[::-1]
+    return (60./clusters)[cluster_sort][0]
@@ -0,0 +1,268 @@
+"""Piano roll images rasterized directly into a NumPy RGB buffer
+
+Replaces the matplotlib figures the web app used to draw piano rolls. The
+layout mimics the old plots (dark axes, octave and half-second grid lines,
+green notes, note names on the y axis and seconds on the x axis), but every
+pixel is written with array operations: notes are filled from a summed-area
+coverage map, and tick labels are blitted from glyphs rendered once per
+thread. There is no global plotting state, so renderers can be used from
+worker threads and processes.
+"""
+import base64
+import threading
+from io import BytesIO
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# Finest time step of packed notes in seconds, widened for files too long for 16 bits
+NOTE_TIME_STEP = 0.005
+
+# Font and glyph masks are kept per thread, Pillow font objects are not shared across threads
+_fonts = threading.local()
+
+
+def _hex_to_rgb(color: str) -> Tuple[int, int, int]:
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _glyph(char: str, size: int) -> np.ndarray:
+    """Coverage mask (0-255) of one character, rendered once per thread"""
+    if getattr(_fonts, 'size', None) != size:
+        try:
+            _fonts.font = ImageFont.load_default(size=size)
+        except TypeError:
+            # Pillow < 10.1 only has the fixed-size bitmap font
+            _fonts.font = ImageFont.load_default()
+        _fonts.size = size
+        _fonts.glyphs = {}
+    mask = _fonts.glyphs.get(char)
+    if mask is None:
+        font = _fonts.font
+        ascent, descent = font.getmetrics()
+        glyph = Image.new('L', (max(1, int(round(font.getlength(char)))), ascent + descent))
+        ImageDraw.Draw(glyph).text((0, 0), char, fill=255, font=font)
+        mask = _fonts.glyphs[char] = np.asarray(glyph)
+    return mask
+
+
+def _text_mask(text: str, size: int) -> np.ndarray:
+    return np.hstack([_glyph(char, size) for char in text])
+
+
+def note_arrays(midi_data) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Onsets, offsets and pitches of the non-drum notes of a PrettyMIDI object"""
+    notes = [(note.start, note.end, note.pitch)
+             for instrument in midi_data.instruments if not instrument.is_drum
+             for note in instrument.notes]
+    if not notes:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    onsets, offsets, pitches = zip(*notes)
+    return np.array(onsets, dtype=np.float64), np.array(offsets, dtype=np.float64), np.array(pitches, dtype=np.int64)
+
+
+def pack_notes(onsets, offsets, pitches, start_time: float) -> Dict:
+    """Compact, JSON-ready note arrays for drawing a piano roll in the browser
+
+    Notes are sorted by onset and times are counted in steps of time_step
+    seconds relative to start_time. Onsets are delta-encoded as uint16,
+    durations are uint16 and pitches uint8; each array is sent as base64 of
+    its little-endian bytes, about 7 characters per note.
+    """
+    onsets = np.asarray(onsets, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.float64)
+    order = np.argsort(onsets, kind='stable')
+    starts = np.maximum(onsets[order] - start_time, 0)
+    durations = np.maximum(offsets[order] - onsets[order], 0)
+    longest = max(starts.max(initial=0), durations.max(initial=0))
+    time_step = max(NOTE_TIME_STEP, longest / 65535)
+
+    # Quantize before taking deltas so decoding reproduces the quantized onsets exactly
+    start_steps = np.minimum(np.rint(starts / time_step), 65535).astype(np.int64)
+    onset_deltas = np.diff(start_steps, prepend=0)
+    duration_steps = np.minimum(np.rint(durations / time_step), 65535)
+
+    def encode(values, dtype):
+        return base64.b64encode(np.asarray(values).astype(dtype).tobytes()).decode()
+
+    return {
+        'count': int(len(order)),
+        'time_step': time_step,
+        'onsets': encode(onset_deltas, '<u2'),
+        'durations': encode(duration_steps, '<u2'),
+        'pitches': encode(np.clip(np.asarray(pitches)[order], 0, 127), 'u1')
+    }
+
+
+def pitch_ticks(min_pitch: int, max_pitch: int) -> List[Tuple[int, str]]:
+    """(pitch, label) for the natural notes in range, C carries its octave number"""
+    ticks = []
+    for octave in range(min_pitch // 12, max_pitch // 12 + 1):
+        for note_idx, note_name in enumerate(NOTE_NAMES):
+            pitch = octave * 12 + note_idx
+            if min_pitch <= pitch <= max_pitch:
+                if note_idx == 0:  # Only label 'C' notes with octave
+                    ticks.append((pitch, f'{note_name}{octave}'))
+                elif note_idx % 2 == 0:  # Label only natural notes (non-sharps)
+                    ticks.append((pitch, note_name))
+    return ticks
+
+
+def _coverage(x0, x1, y0, y1, shape) -> np.ndarray:
+    """Per-pixel count of the rectangles [y0, y1) x [x0, x1) covering it"""
+    corners = np.zeros((shape[0] + 1, shape[1] + 1), dtype=np.int32)
+    np.add.at(corners, (y0, x0), 1)
+    np.add.at(corners, (y0, x1), -1)
+    np.add.at(corners, (y1, x0), -1)
+    np.add.at(corners, (y1, x1), 1)
+    return corners.cumsum(axis=0).cumsum(axis=1)[:shape[0], :shape[1]]
+
+
+class PianoRollRenderer:
+    def __init__(self, width: int = 800, height: int = 300):
+        """
+        Args:
+            width: Image width in pixels, including the tick labels
+            height: Image height in pixels, including the tick labels
+        """
+        self.width = width
+        self.height = height
+
+        # Colors, same as the matplotlib plots they replace
+        self.figure_color = _hex_to_rgb('#ffffff')
+        self.bg_color = _hex_to_rgb('#2b2b2b')
+        self.grid_color = _hex_to_rgb('#404040')
+        self.octave_line_color = _hex_to_rgb('#505050')
+        self.note_color = _hex_to_rgb('#00ff00')
+        self.note_border = _hex_to_rgb('#00cc00')
+        self.frame_color = _hex_to_rgb('#000000')
+        self.text_color = _hex_to_rgb('#000000')
+
+        # Layout
+        self.font_size = 10
+        self.margin_left = 34   # Room for the note names
+        self.margin_bottom = 20  # Room for the time labels
+        self.margin_top = 4
+        self.margin_right = 12
+        self.tick_length = 3
+        self.label_gap = 4  # Minimum pixels between neighbouring time labels
+        self.note_height = 0.7  # In semitones
+        self.beat_duration = 0.5  # Spacing of the vertical grid lines in seconds
+        self.png_compress_level = 6
+
+    def render(self, onsets: Iterable[float], offsets: Iterable[float], pitches: Iterable[int],
+               start_time: float, min_pitch: int, max_pitch: int, duration: float) -> bytes:
+        """Draw a piano roll and return it as PNG bytes
+
+        Args:
+            onsets: Note start times in seconds
+            offsets: Note end times in seconds
+            pitches: MIDI note numbers
+            start_time: Time shown at the left edge
+            min_pitch: Lowest pitch shown (one semitone of padding is added)
+            max_pitch: Highest pitch shown (one semitone of padding is added)
+            duration: Seconds shown from start_time to the right edge
+        """
+        duration = max(float(duration), 1e-6)
+        left, top = self.margin_left, self.margin_top
+        plot_w = self.width - self.margin_left - self.margin_right
+        plot_h = self.height - self.margin_top - self.margin_bottom
+        pitch_high = max_pitch + 1
+        x_scale = plot_w / duration
+        y_scale = plot_h / (max_pitch - min_pitch + 2)
+
+        def x_px(t):
+            return np.rint(np.asarray(t, dtype=np.float64) * x_scale).astype(np.int64)
+
+        def y_px(pitch):
+            return np.rint((pitch_high - np.asarray(pitch, dtype=np.float64)) * y_scale).astype(np.int64)
+
+        image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        image[:] = self.figure_color
+        plot = image[top:top + plot_h, left:left + plot_w]
+        plot[:] = self.bg_color
+
+        # Vertical grid lines (time markers)
+        grid_x = x_px(np.arange(0, duration + self.beat_duration, self.beat_duration))
+        plot[:, grid_x[grid_x < plot_w]] = self.grid_color
+
+        # Octave boundaries (horizontal lines)
+        ticks = pitch_ticks(min_pitch, max_pitch)
+        c_pitches = [pitch for pitch, _ in ticks if pitch % 12 == 0]
+        if c_pitches:
+            plot[np.clip(y_px(c_pitches), 0, plot_h - 1)] = self.octave_line_color
+
+        # Notes, clipped to the plot area and at least one pixel wide and tall
+        onsets = np.asarray(onsets, dtype=np.float64)
+        if onsets.size:
+            pitches = np.asarray(pitches, dtype=np.float64)
+            x0 = np.clip(x_px(onsets - start_time), 0, plot_w)
+            x1 = np.clip(x_px(np.asarray(offsets, dtype=np.float64) - start_time), 0, plot_w)
+            y0 = np.clip(y_px(pitches + self.note_height / 2), 0, plot_h)
+            y1 = np.clip(y_px(pitches - self.note_height / 2), 0, plot_h)
+            x1 = np.maximum(x1, np.minimum(x0 + 1, plot_w))
+            y1 = np.maximum(y1, np.minimum(y0 + 1, plot_h))
+            outer = _coverage(x0, x1, y0, y1, plot.shape)
+            # Notes too small for a border are drawn in the border color only
+            inner = (x1 - x0 > 2) & (y1 - y0 > 2)
+            fill = _coverage(x0[inner] + 1, x1[inner] - 1, y0[inner] + 1, y1[inner] - 1, plot.shape)
+            plot[outer > 0] = self.note_border
+            plot[fill > 0] = self.note_color
+
+        # Axes frame
+        image[top - 1:top + plot_h + 1, [left - 1, left + plot_w]] = self.frame_color
+        image[[top - 1, top + plot_h], left - 1:left + plot_w + 1] = self.frame_color
+
+        # Tick marks and labels
+        y_ticks = list(zip(y_px([pitch for pitch, _ in ticks]).tolist(), [label for _, label in ticks]))
+        time_ticks = np.arange(0, duration + 1, 1.0)
+        x_ticks = [(x, f"{start_time + t:.1f}") for t, x in
+                   zip(time_ticks.tolist(), x_px(time_ticks).tolist()) if x <= plot_w]
+        for y, _ in y_ticks:
+            image[top + y, left - 1 - self.tick_length:left - 1] = self.frame_color
+        for x, _ in x_ticks:
+            image[top + plot_h + 1:top + plot_h + 1 + self.tick_length, left + min(x, plot_w)] = self.frame_color
+        self._draw_y_labels(image, y_ticks)
+        self._draw_x_labels(image, x_ticks, top + plot_h + 1 + self.tick_length)
+
+        buffer = BytesIO()
+        Image.fromarray(image).save(buffer, format='PNG', compress_level=self.png_compress_level)
+        return buffer.getvalue()
+
+    def _blit(self, image: np.ndarray, mask: np.ndarray, x: int, y: int):
+        """Blend a text mask into the image with its top-left corner at (x, y)"""
+        h, w = mask.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, image.shape[1]), min(y + h, image.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        alpha = mask[y0 - y:y1 - y, x0 - x:x1 - x, None] / 255.0
+        region = image[y0:y1, x0:x1]
+        region[:] = np.rint(region * (1 - alpha) + np.array(self.text_color) * alpha)
+
+    def _draw_y_labels(self, image: np.ndarray, y_ticks):
+        """Note names right-aligned next to their tick, octave labels win over overlapping names"""
+        taken = []  # (top, bottom) of the labels drawn so far
+        for y, label in sorted(y_ticks, key=lambda tick: tick[1][0] != 'C' or len(tick[1]) == 1):
+            mask = _text_mask(label, self.font_size)
+            text_top = self.margin_top + y - mask.shape[0] // 2
+            # Glyph masks include empty rows for ascent and descent, overlap is judged on the middle
+            span = (text_top + 2, text_top + mask.shape[0] - 2)
+            if any(span[0] < bottom and top < span[1] for top, bottom in taken):
+                continue
+            taken.append(span)
+            self._blit(image, mask, self.margin_left - 2 - self.tick_length - mask.shape[1], text_top)
+
+    def _draw_x_labels(self, image: np.ndarray, x_ticks, text_top: int):
+        """Time labels centred under their tick, skipping labels that would overlap the previous one"""
+        last_right = None
+        for x, label in x_ticks:
+            mask = _text_mask(label, self.font_size)
+            text_left = min(self.margin_left + x - mask.shape[1] // 2, self.width - mask.shape[1])
+            if last_right is not None and text_left < last_right + self.label_gap:
+                continue
+            self._blit(image, mask, text_left, text_top)
+            last_right = text_left + mask.shape[1]
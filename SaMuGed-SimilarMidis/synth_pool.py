@@ -0,0 +1,257 @@
+"""Persistent in-process FluidSynth synthesizers for rendering MIDI to PCM
+
+Running the fluidsynth CLI per preview re-loads the multi-megabyte
+soundfont on every request. A SynthPool keeps up to `size` pyfluidsynth
+synthesizers with the soundfont loaded and lends one to each render;
+renders beyond that wait in a bounded queue. Synthesizers are created on
+first use, reset between renders, and drive no audio device: samples are
+pulled with get_samples, so several renders run in parallel threads.
+"""
+import os
+import wave
+import queue
+import struct
+import logging
+import tempfile
+import threading
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+import pretty_midi
+from config import AUDIO_PREVIEW_GAIN, SYNTH_POOL_SIZE, SYNTH_QUEUE_LIMIT, SYNTH_QUEUE_TIMEOUT
+
+try:
+    import fluidsynth
+except (ImportError, OSError):  # pyfluidsynth not installed, or libfluidsynth not found
+    fluidsynth = None
+
+SAMPLE_RATE = 44100
+BLOCK_FRAMES = 4096  # Largest block of stereo frames generated per get_samples call
+RELEASE_SECONDS = 0.5  # Rendered after the last event so notes can ring out
+DRUM_BANK = 128
+
+# Event kinds, in the order they are applied when they share a timestamp
+PROGRAM, NOTE_OFF, CONTROL, PITCH_BEND, NOTE_ON = range(5)
+
+logger = logging.getLogger(__name__)
+
+
+class SynthPoolBusy(RuntimeError):
+    """Raised when a render cannot get a synthesizer within the queue limit or timeout"""
+
+
+def midi_events(midi_data: pretty_midi.PrettyMIDI, trim_silence: bool = True) -> List[Tuple]:
+    """Time-sorted (time, kind, channel, a, b) synth events of a MIDI file
+
+    Each instrument gets its own channel, drums select the percussion bank.
+    With trim_silence, everything is shifted so the first non-drum note
+    starts at time 0, like create_trimmed_midi does for the CLI renderer.
+    """
+    offset = 0.0
+    if trim_silence:
+        starts = [note.start for instrument in midi_data.instruments
+                  if not instrument.is_drum for note in instrument.notes]
+        offset = float(min(starts)) if starts else 0.0
+
+    events = []
+    for channel, instrument in enumerate(midi_data.instruments[:256]):
+        bank = DRUM_BANK if instrument.is_drum else 0
+        # Plain ints and floats, ctypes rejects NumPy scalars
+        events.append((0.0, PROGRAM, channel, bank, int(instrument.program)))
+        for note in instrument.notes:
+            events.append((max(float(note.start) - offset, 0.0), NOTE_ON, channel, int(note.pitch), int(note.velocity)))
+            events.append((max(float(note.end) - offset, 0.0), NOTE_OFF, channel, int(note.pitch), 0))
+        for control in instrument.control_changes:
+            events.append((max(float(control.time) - offset, 0.0), CONTROL, channel,
+                           int(control.number), int(control.value)))
+        for bend in instrument.pitch_bends:
+            events.append((max(float(bend.time) - offset, 0.0), PITCH_BEND, channel, int(bend.pitch), 0))
+    events.sort(key=lambda event: (event[0], event[1]))
+    return events
+
+
+def wav_header(frames: int) -> bytes:
+    """44-byte header of a stereo 16-bit WAV file with the given number of frames
+
+    Knowing the length up front lets a stream carry an exact header and
+    Content-Length, so players can show the duration and seek.
+    """
+    data_bytes = frames * 4
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_bytes, b'WAVE', b'fmt ', 16, 1, 2,
+                       SAMPLE_RATE, SAMPLE_RATE * 4, 4, 16, b'data', data_bytes)
+
+
+def write_wav(path: str, blocks: Iterator[np.ndarray]):
+    """Write interleaved stereo int16 blocks to a WAV file"""
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        for block in blocks:
+            wav_file.writeframes(block.tobytes())
+
+
+class SynthPool:
+    def __init__(self, soundfont_path: str, size: int = SYNTH_POOL_SIZE,
+                 queue_limit: int = SYNTH_QUEUE_LIMIT, timeout: float = SYNTH_QUEUE_TIMEOUT,
+                 gain: float = AUDIO_PREVIEW_GAIN):
+        """
+        Args:
+            soundfont_path: Soundfont loaded into every synthesizer
+            size: Maximum number of synthesizers, i.e. concurrent renders
+            queue_limit: Maximum number of renders waiting for a synthesizer
+            timeout: Seconds a render waits for a synthesizer before giving up
+            gain: Synthesizer gain (volume)
+        """
+        if fluidsynth is None:
+            raise RuntimeError("pyfluidsynth or the FluidSynth library is not available")
+        if not os.path.exists(soundfont_path):
+            raise RuntimeError(f"Soundfont not found: {soundfont_path}")
+        self.soundfont_path = soundfont_path
+        self.size = max(1, size)
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.gain = gain
+        self._idle = queue.Queue()  # (Synth, soundfont id) ready for a render
+        self._lock = threading.Lock()
+        self.created = 0
+        self.waiting = 0
+        self.renders = 0
+        self.rejected = 0
+
+    def _new_synth(self):
+        synth = fluidsynth.Synth(gain=self.gain, samplerate=SAMPLE_RATE)
+        sfid = synth.sfload(self.soundfont_path)
+        if sfid == -1:
+            synth.delete()
+            raise RuntimeError(f"Failed to load soundfont: {self.soundfont_path}")
+        logger.info(f"Loaded soundfont into synthesizer {self.created}/{self.size}")
+        return synth, sfid
+
+    def _acquire(self):
+        """Take an idle synthesizer, create one if below size, otherwise queue for one"""
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self.created < self.size:
+                self.created += 1
+                create = True
+            elif self.waiting >= self.queue_limit:
+                self.rejected += 1
+                raise SynthPoolBusy(f"{self.waiting} renders already waiting for a synthesizer")
+            else:
+                self.waiting += 1
+                create = False
+
+        if create:
+            try:
+                return self._new_synth()
+            except Exception:
+                with self._lock:
+                    self.created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self.rejected += 1
+            raise SynthPoolBusy(f"No synthesizer free after {self.timeout}s")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def _release(self, entry):
+        synth, _ = entry
+        try:
+            synth.system_reset()
+        except Exception as e:
+            # A synthesizer that cannot be reset is dropped, a new one is created on demand
+            logger.error(f"Dropping synthesizer after failed reset: {str(e)}")
+            with self._lock:
+                self.created -= 1
+            return
+        self._idle.put(entry)
+
+    def open_stream(self, midi_path: str, trim_silence: bool = True) -> Tuple[int, Iterator[np.ndarray]]:
+        """Reserve a synthesizer for a MIDI file and return (total frames, block iterator)
+
+        Blocks are interleaved stereo int16 samples, rendered only as they
+        are consumed. The synthesizer is reserved before returning, so
+        SynthPoolBusy is raised here rather than in the middle of a stream;
+        it is held until the iterator is exhausted or closed.
+        """
+        events = midi_events(pretty_midi.PrettyMIDI(midi_path), trim_silence)
+        last_frame = int(round(events[-1][0] * SAMPLE_RATE)) if events else 0
+        blocks = self._render_events(events)
+        next(blocks)  # Runs up to the reservation
+        return last_frame + int(RELEASE_SECONDS * SAMPLE_RATE), blocks
+
+    def _render_events(self, events: List[Tuple]) -> Iterator[np.ndarray]:
+        entry = self._acquire()
+        synth, sfid = entry
+        try:
+            yield None  # Consumed by open_stream once the synthesizer is reserved
+            frame = 0
+            for time, kind, channel, a, b in events:
+                target = int(round(time * SAMPLE_RATE))
+                while frame < target:
+                    frames = min(BLOCK_FRAMES, target - frame)
+                    yield synth.get_samples(frames)
+                    frame += frames
+                if kind == NOTE_ON:
+                    synth.noteon(channel, a, b)
+                elif kind == NOTE_OFF:
+                    synth.noteoff(channel, a)
+                elif kind == CONTROL:
+                    synth.cc(channel, a, b)
+                elif kind == PITCH_BEND:
+                    synth.pitch_bend(channel, a)
+                else:
+                    synth.program_select(channel, sfid, a, b)
+
+            release = int(RELEASE_SECONDS * SAMPLE_RATE)
+            while release > 0:
+                frames = min(BLOCK_FRAMES, release)
+                yield synth.get_samples(frames)
+                release -= frames
+            with self._lock:
+                self.renders += 1
+        finally:
+            self._release(entry)
+
+    def render_to_wav(self, midi_path: str) -> Optional[str]:
+        """Render a MIDI file with leading silence trimmed to a temporary WAV file
+
+        Returns:
+            Path to the temporary WAV file or None if error
+
+        Raises:
+            SynthPoolBusy: If no synthesizer became free in time
+        """
+        fd, wav_path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            write_wav(wav_path, self.open_stream(midi_path)[1])
+            return wav_path
+        except SynthPoolBusy:
+            os.remove(wav_path)
+            raise
+        except Exception as e:
+            logger.error(f"In-process MIDI to WAV rendering error: {str(e)}")
+            os.remove(wav_path)
+            return None
+
+    def stats(self):
+        """Synthesizer usage and queue counters"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'idle': self._idle.qsize(),
+                'waiting': self.waiting,
+                'queue_limit': self.queue_limit,
+                'renders': self.renders,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,257 @@
+"""Piano roll thumbnails for the dataset, rendered ahead of time
+
+Thumbnails (PNG plus duration/pitch-range metadata) are written to a
+content-addressed ContentStore by a process pool, and a per-dataset manifest
+maps each dataset file to its thumbnail key so lookups never touch the MIDI
+file. The web app runs this stage after MIDIDatabase.initialize; it can also
+be run offline before starting the server.
+
+Usage:
+    python thumbnails.py [dataset_path]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import pretty_midi
+from piano_roll_renderer import PianoRollRenderer, note_arrays, pack_notes
+from content_cache import ContentStore, file_digest
+from config import DATASET_PATH, INGEST_WORKERS, INGEST_CHUNK_SIZE
+
+# Bump when the rendering changes so stored thumbnails are re-rendered
+THUMBNAIL_VERSION = 3
+
+logger = logging.getLogger(__name__)
+
+# Per-process store used by rendering workers
+_worker_store = None
+
+_renderer = PianoRollRenderer()
+
+
+def thumbnail_key(midi_path: str) -> str:
+    """Content address of a MIDI file's thumbnail"""
+    return file_digest(midi_path, salt=f'piano_roll:{THUMBNAIL_VERSION}')
+
+
+def data_url(png: bytes) -> str:
+    """Embed PNG bytes as a data URL for an <img> src"""
+    return f"data:image/png;base64,{base64.b64encode(png).decode()}"
+
+
+def render_piano_roll(midi_path: str) -> Tuple[Optional[bytes], Dict]:
+    """Generate a piano roll visualization and extract key data
+
+    Returns:
+        Tuple of (PNG bytes, metadata dict); PNG bytes are None if rendering failed
+    """
+    try:
+        midi_data = pretty_midi.PrettyMIDI(midi_path)
+
+        # Collect all notes from non-drum instruments
+        onsets, offsets, pitches = note_arrays(midi_data)
+        if len(pitches):
+            min_pitch = int(pitches.min())
+            max_pitch = int(pitches.max())
+            start_time = float(onsets.min())
+            end_time = float(offsets.max())
+        else:
+            # Defaults if no notes found
+            min_pitch, max_pitch, start_time, end_time = 60, 72, 0, 4
+
+        # Calculate duration
+        duration = end_time - start_time
+
+        # Add padding to the range, but ensure we include C and octave boundaries
+        min_pitch_octave = (min_pitch // 12) * 12  # Find nearest C below
+        max_pitch_octave = ((max_pitch // 12) + 1) * 12  # Find nearest C above
+
+        min_pitch = max(0, min_pitch_octave - 3)
+        max_pitch = min(127, max_pitch_octave + 3)
+
+        png = _renderer.render(onsets, offsets, pitches, start_time, min_pitch, max_pitch, duration)
+
+        # Return both image and metadata
+        return png, {
+            'min_pitch': min_pitch,
+            'max_pitch': max_pitch,
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration': duration,
+            'notes': pack_notes(onsets, offsets, pitches, start_time)
+        }
+
+    except Exception as e:
+        logger.error(f"Piano roll generation error: {str(e)}")
+        return None, {
+            'image': "",
+            'min_pitch': 60,
+            'max_pitch': 72,
+            'start_time': 0,
+            'end_time': 4,
+            'duration': 4,
+            'notes': None
+        }
+
+
+def _init_thumbnail_worker(store_dir: str):
+    """Open the thumbnail store once per worker process"""
+    global _worker_store
+    _worker_store = ContentStore(store_dir, '.png')
+
+
+def _render_into_store(store: ContentStore, midi_path: str) -> Optional[str]:
+    """Render a thumbnail into the store unless it is already there, returns its key"""
+    key = thumbnail_key(midi_path)
+    if store.blob_path(key) is None:
+        png, metadata = render_piano_roll(midi_path)
+        if png is None:
+            return None
+        store.put(key, png, metadata)
+    return key
+
+
+def _render_chunk(paths: List[str]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """Render a chunk of files in a worker, returning (path, key, error) per file"""
+    results = []
+    for path in paths:
+        try:
+            results.append((path, _render_into_store(_worker_store, path), None))
+        except Exception as e:
+            results.append((path, None, str(e)))
+    return results
+
+
+class ThumbnailStore:
+    def __init__(self, store_dir: str, workers: Optional[int] = INGEST_WORKERS,
+                 chunk_size: int = INGEST_CHUNK_SIZE):
+        """
+        Args:
+            store_dir: Directory of the content-addressed PNG store
+            workers: Number of rendering processes (None = all cores, 1 = in-process)
+            chunk_size: Number of files submitted to a worker per task
+        """
+        self.store = ContentStore(store_dir, '.png')
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self.keys = {}  # dataset path -> thumbnail key
+        self._setup_logging()
+
+    def _setup_logging(self):
+        """Setup logging configuration"""
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+        self.logger = logging.getLogger(__name__)
+
+    def _get_manifest_path(self, dataset_path: str) -> str:
+        dir_name = os.path.basename(os.path.abspath(dataset_path))
+        return os.path.join(self.store.directory, f'manifest_{dir_name}.json')
+
+    def _load_manifest(self, manifest_path: str) -> Dict:
+        """Read path -> [size, mtime/hash, key] entries, empty if missing or stale"""
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != THUMBNAIL_VERSION:
+            return {}
+        return manifest.get('entries', {})
+
+    def _save_manifest(self, manifest_path: str, entries: Dict):
+        os.makedirs(self.store.directory, exist_ok=True)
+        tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': THUMBNAIL_VERSION, 'entries': entries}, f)
+        os.replace(tmp_path, manifest_path)
+
+    def generate(self, dataset_path: str, midi_paths: Sequence[str],
+                 fingerprints: Sequence[Tuple[int, int]]) -> int:
+        """Make sure every dataset file has a stored thumbnail
+
+        Files whose fingerprint matches the manifest and whose thumbnail is
+        still stored are skipped; the rest are rendered in a process pool.
+
+        Args:
+            dataset_path: Dataset root, names the manifest
+            midi_paths: Dataset files, e.g. MIDIDatabase.file_paths
+            fingerprints: Fingerprint per file, e.g. MIDIDatabase.fingerprints
+
+        Returns:
+            Number of files that needed rendering or re-keying
+        """
+        manifest_path = self._get_manifest_path(dataset_path)
+        previous = self._load_manifest(manifest_path)
+        entries = {}
+        pending = []
+        for path, fingerprint in zip(midi_paths, fingerprints):
+            fingerprint = [int(value) for value in fingerprint]
+            entry = previous.get(path)
+            if entry is not None and entry[:2] == fingerprint and self.store.blob_path(entry[2]):
+                entries[path] = entry
+            else:
+                pending.append((path, fingerprint))
+
+        self.logger.info(f"Thumbnails: {len(entries)} up to date, {len(pending)} to render")
+        if pending:
+            fingerprint_of = dict(pending)
+            start = time.time()
+            failed = 0
+            for path, key, error in self._iter_rendered([path for path, _ in pending]):
+                if key is None:
+                    failed += 1
+                    if error is not None:
+                        self.logger.error(f"Error rendering thumbnail for {path}: {error}")
+                    continue
+                entries[path] = fingerprint_of[path] + [key]
+            self.logger.info(f"Rendered {len(pending) - failed}/{len(pending)} thumbnails "
+                             f"in {time.time() - start:.1f}s")
+
+        if pending or len(entries) != len(previous):
+            self._save_manifest(manifest_path, entries)
+        self.keys = {path: entry[2] for path, entry in entries.items()}
+        return len(pending)
+
+    def _iter_rendered(self, midi_paths: List[str]):
+        """Yield (path, key, error) for each file, rendering in worker processes"""
+        chunks = [midi_paths[i:i + self.chunk_size]
+                  for i in range(0, len(midi_paths), self.chunk_size)]
+        workers = min(self.workers, len(chunks))
+
+        if workers <= 1:
+            for path in midi_paths:
+                try:
+                    yield path, _render_into_store(self.store, path), None
+                except Exception as e:
+                    yield path, None, str(e)
+            return
+
+        self.logger.info(f"Rendering thumbnails with {workers} worker processes")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_thumbnail_worker,
+                                 initargs=(self.store.directory,)) as executor:
+            for chunk_results in executor.map(_render_chunk, chunks):
+                yield from chunk_results
+
+    def key_for(self, midi_path: str) -> Optional[str]:
+        """Thumbnail key of a dataset file from the manifest, without reading the file"""
+        return self.keys.get(midi_path)
+
+
+def main():
+    from database import MIDIDatabase
+    dataset_path = sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH
+    db = MIDIDatabase()
+    db.initialize(dataset_path)
+    thumbnails = ThumbnailStore(os.path.join(db.cache_dir, 'piano_rolls'))
+    thumbnails.generate(dataset_path, db.file_paths, db.fingerprints)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,10 @@
-from flask import Flask, request, render_template, jsonify, send_file, after_this_request
+from flask import Flask, Response, request, render_template, jsonify, send_file
 import os
 import sys
 import logging
 import tempfile
 import json
-import base64
 import pretty_midi
-from io import BytesIO
-import matplotlib.pyplot as plt
-import numpy as np
-import subprocess
 import time
 
 # Add the parent directory to the path so we can import the existing modules
@@ -18,7 +13,14 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Import existing functionality
 from database import MIDIDatabase
 from feature_calculator import FeatureCalculator
-from config import DEFAULT_FEATURE_WEIGHTS, DATASET_PATH, MAX_RESULTS
+from content_cache import LRUCache, file_digest
+from thumbnails import ThumbnailStore, render_piano_roll, thumbnail_key, data_url
+from piano_roll_renderer import PianoRollRenderer, note_arrays, pack_notes
+from audio_previews import AudioPreviewStore
+from synth_pool import SynthPool, SynthPoolBusy
+from config import (DEFAULT_FEATURE_WEIGHTS, DATASET_PATH, MAX_RESULTS, PIANO_ROLL_CACHE_ENTRIES,
+                    PIANO_ROLL_CACHE_MB, UPLOAD_CACHE_ENTRIES, PRECOMPUTE_THUMBNAILS,
+                    PIANO_ROLL_MODE, AUDIO_PRERENDER_RESULTS, AUDIO_RENDERER)
 
 app = Flask(__name__)
 
@@ -37,10 +39,44 @@ try:
 except Exception as e:
     logger.error(f"Failed to initialize database: {str(e)}")
 
-# In-memory storage for uploaded files
-uploaded_files = {}
-# Store piano roll info
-piano_roll_cache = {}
+
+def _piano_roll_size(piano_roll_data):
+    """Approximate memory held by a cached piano roll: the image and the packed notes"""
+    notes = piano_roll_data.get('notes') or {}
+    return len(piano_roll_data['image']) + sum(len(value) for value in notes.values() if isinstance(value, str))
+
+
+def _remove_upload(file_id, entry):
+    """Delete the stored file of an upload dropped from uploaded_files"""
+    try:
+        os.remove(entry['path'])
+        logger.info(f"Removed evicted upload {file_id}: {entry['path']}")
+    except OSError as e:
+        logger.warning(f"Could not remove evicted upload {entry['path']}: {str(e)}")
+
+
+# Uploaded query files, least recently used uploads are evicted and deleted.
+# The files are kept in the cache directory under their id, so a worker
+# process that did not receive an upload can still load it
+uploaded_files = LRUCache(max_entries=UPLOAD_CACHE_ENTRIES, on_evict=_remove_upload)
+UPLOAD_DIR = os.path.join(db.cache_dir, 'uploads')
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Piano roll images and metadata keyed by MIDI content digest; the in-memory
+# tier is per process, the on-disk store survives restarts and is shared by
+# all worker processes
+piano_roll_cache = LRUCache(max_entries=PIANO_ROLL_CACHE_ENTRIES,
+                            max_bytes=PIANO_ROLL_CACHE_MB * 1024 * 1024,
+                            size_fn=lambda data: _piano_roll_size(data))
+thumbnails = ThumbnailStore(os.path.join(db.cache_dir, 'piano_rolls'))
+piano_roll_renderer = PianoRollRenderer()
+piano_roll_store = thumbnails.store
+
+# Render thumbnails for every dataset file up front so searches only read them
+if PRECOMPUTE_THUMBNAILS:
+    try:
+        thumbnails.generate(DATASET_PATH, db.file_paths, db.fingerprints)
+    except Exception as e:
+        logger.error(f"Failed to precompute thumbnails: {str(e)}")
 
 # Path to soundfont file
 SOUNDFONT_PATH = "/app/soundfonts/FluidR3_GM.sf2"
@@ -54,11 +90,61 @@ if not os.path.exists(SOUNDFONT_PATH):
     else:
         logger.error("No soundfont found. Audio playback may not work.")
 
+# Synthesizers with the soundfont kept loaded, falling back to the fluidsynth CLI
+synth_pool = None
+if AUDIO_RENDERER == 'pool':
+    try:
+        synth_pool = SynthPool(SOUNDFONT_PATH)
+    except RuntimeError as e:
+        logger.warning(f"In-process synthesis unavailable, using the fluidsynth CLI: {str(e)}")
+
+# Rendered audio previews, shared with other workers through the cache directory
+audio_previews = AudioPreviewStore(os.path.join(db.cache_dir, 'audio_previews'), SOUNDFONT_PATH,
+                                   synth_pool=synth_pool)
+
 
 @app.route('/')
 def index():
     """Render the main page"""
-    return render_template('index.html', feature_weights=DEFAULT_FEATURE_WEIGHTS)
+    return render_template('index.html', feature_weights=DEFAULT_FEATURE_WEIGHTS,
+                           piano_roll_mode=PIANO_ROLL_MODE)
+
+
+def get_piano_roll_mode(data):
+    """Piano roll mode requested by the client, falling back to PIANO_ROLL_MODE"""
+    mode = (data or {}).get('piano_roll_mode', PIANO_ROLL_MODE)
+    return mode if mode in ('image', 'notes') else PIANO_ROLL_MODE
+
+
+def piano_roll_fields(piano_roll_data, mode):
+    """Response fields for a piano roll: a PNG data URL, or packed notes drawn by the browser"""
+    if mode == 'notes':
+        return {
+            'piano_roll_notes': piano_roll_data.get('notes'),
+            'start_time': piano_roll_data['start_time']
+        }
+    return {'piano_roll': piano_roll_data['image']}
+
+
+def get_upload(file_id):
+    """Entry of an uploaded file, loaded from UPLOAD_DIR if another worker received it
+
+    Returns:
+        Dict with path, name and query_vector, or None if the upload is unknown
+    """
+    upload = uploaded_files.get(file_id)
+    if upload is not None or not isinstance(file_id, str) or not file_id.isalnum():
+        return upload
+    upload_path = os.path.join(UPLOAD_DIR, f'{file_id}.mid')
+    if not os.path.exists(upload_path):
+        return None
+    upload = {
+        'path': upload_path,
+        'name': None,
+        'query_vector': db.query_vector(upload_path)
+    }
+    uploaded_files.put(file_id, upload)
+    return upload
 
 
 @app.route('/upload', methods=['POST'])
@@ -76,25 +162,40 @@ def upload_midi():
             return jsonify({'error': 'Only MIDI files are supported'}), 400
 
         # Save the file temporarily
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mid', delete=False)
+        temp_file = tempfile.NamedTemporaryFile(suffix='.tmp', dir=UPLOAD_DIR, delete=False)
         file.save(temp_file.name)
         temp_file.close()
         
-        # Store the file path with a unique ID
-        file_id = str(hash(file.filename + str(os.path.getsize(temp_file.name))))
-        uploaded_files[file_id] = {
-            'path': temp_file.name,
-            'name': file.filename
-        }
+        # Store the file under an ID derived from its name and content, which
+        # every worker process computes the same way
+        file_id = file_digest(temp_file.name, salt=file.filename)
+        # Replace an earlier upload of the same file
+        previous = uploaded_files.pop(file_id)
+        if previous is not None:
+            _remove_upload(file_id, previous)
+        upload_path = os.path.join(UPLOAD_DIR, f'{file_id}.mid')
+        os.replace(temp_file.name, upload_path)
+        
+        # Extract the query features once; searches only re-weight this vector
+        uploaded_files.put(file_id, {
+            'path': upload_path,
+            'name': file.filename,
+            'query_vector': db.query_vector(upload_path)
+        })
         
         # Generate piano roll visualization with metadata
-        piano_roll_data = generate_piano_roll_data(temp_file.name)
-        piano_roll_cache[file_id] = piano_roll_data
+        piano_roll_data = get_piano_roll_data(upload_path)
+        
+        # Have the audio ready by the time the user presses play
+        audio_previews.prerender([upload_path])
         
         return jsonify({
             'file_id': file_id, 
             'filename': file.filename,
-            'piano_roll': piano_roll_data['image']
+            'duration': piano_roll_data['duration'],
+            'min_pitch': piano_roll_data['min_pitch'],
+            'max_pitch': piano_roll_data['max_pitch'],
+            **piano_roll_fields(piano_roll_data, get_piano_roll_mode(request.form))
         })
         
     except Exception as e:
@@ -109,47 +210,60 @@ def search_similar():
         data = request.json
         file_id = data.get('file_id')
         weights = data.get('weights', DEFAULT_FEATURE_WEIGHTS)
+        piano_roll_mode = get_piano_roll_mode(data)
         
-        if file_id not in uploaded_files:
+        upload = get_upload(file_id)
+        if upload is None:
             return jsonify({'error': 'File not found'}), 404
             
-        # Get the file path
-        file_path = uploaded_files[file_id]['path']
+        # Get the file path and its precomputed feature vector
+        file_path = upload['path']
+        query_vector = upload.get('query_vector')
         logger.info(f"Searching for patterns similar to: {file_path}")
         
         # Perform the search
-        results = db.find_similar(file_path, weights)
+        if query_vector is None:
+            logger.error(f"No features available for query file: {file_path}")
+            results = []
+        else:
+            results = db.find_similar_vector(query_vector, weights)
         logger.info(f"Found {len(results)} results")
         
+        top_results = sorted(results, key=lambda x: x[1], reverse=True)[:MAX_RESULTS]
+        
+        # Render audio for the most likely clicks in the background
+        if AUDIO_PRERENDER_RESULTS > 0:
+            audio_previews.prerender([path for path, _ in top_results[:AUDIO_PRERENDER_RESULTS]])
+        
         # Format results
         formatted_results = []
-        for idx, (path, score) in enumerate(sorted(results, key=lambda x: x[1], reverse=True)[:MAX_RESULTS]):
+        for idx, (path, score) in enumerate(top_results):
             # Clean and normalize the path
             clean_path = os.path.normpath(path)
             logger.info(f"Result #{idx+1}: {clean_path} (score: {score:.2%})")
             
-            # Generate piano roll data for each result
-            if path not in piano_roll_cache:
-                piano_roll_data = generate_piano_roll_data(path)
-                piano_roll_cache[path] = piano_roll_data
-            else:
-                piano_roll_data = piano_roll_cache[path]
+            # Piano roll data for each result, rendered only on a cache miss
+            piano_roll_data = get_piano_roll_data(path)
             
             # Cache the full path for better tracking
             formatted_results.append({
+                'id': db.resolve_path(path),
                 'path': os.path.basename(clean_path),
                 'full_path': clean_path,  # this is the complete, normalized path
                 'score': f"{score:.2%}",
-                'piano_roll': piano_roll_data['image'],
                 'duration': piano_roll_data['duration'],
                 'min_pitch': piano_roll_data['min_pitch'],
-                'max_pitch': piano_roll_data['max_pitch']
+                'max_pitch': piano_roll_data['max_pitch'],
+                **piano_roll_fields(piano_roll_data, piano_roll_mode)
             })
             
         # Add query file data to response
+        query_piano_roll = get_piano_roll_data(file_path)
+        if piano_roll_mode == 'notes':
+            query_piano_roll = {k: v for k, v in query_piano_roll.items() if k != 'image'}
         query_data = {
             'file_id': file_id,
-            'piano_roll_data': piano_roll_cache[file_id]
+            'piano_roll_data': query_piano_roll
         }
             
         return jsonify({
@@ -162,97 +276,31 @@ def search_similar():
         return jsonify({'error': str(e)}), 500
 
 
-def create_trimmed_midi(midi_file):
-    """Create a trimmed version of a MIDI file by removing silence at the beginning
-    
-    Args:
-        midi_file: Path to the original MIDI file
-        
-    Returns:
-        Path to the temporary trimmed MIDI file or None if error
-    """
-    try:
-        # Load MIDI
-        midi_data = pretty_midi.PrettyMIDI(midi_file)
-        
-        # Find start time automatically
-        start_time = float('inf')
-        for instrument in midi_data.instruments:
-            if not instrument.is_drum and instrument.notes:
-                first_note = min(instrument.notes, key=lambda x: x.start)
-                start_time = min(start_time, first_note.start)
-        
-        if start_time == float('inf'):
-            start_time = 0
-        
-        if start_time > 0:
-            logger.info(f"Trimming MIDI file, removing {start_time:.2f}s of silence from beginning")
-            
-            # Shift all notes to remove empty space
-            for instrument in midi_data.instruments:
-                for note in instrument.notes:
-                    note.start -= start_time
-                    note.end -= start_time
-        
-        # Save to temporary file
-        fd, temp_path = tempfile.mkstemp(suffix='.mid')
-        os.close(fd)
-        midi_data.write(temp_path)
-        
-        return temp_path
-        
-    except Exception as e:
-        logger.error(f"Error creating trimmed MIDI: {str(e)}")
-        return None
+def send_preview(midi_path):
+    """Audio preview response for a MIDI file
 
-
-def midi_to_wav(midi_path):
-    """Convert a MIDI file to WAV using FluidSynth
-    
-    Args:
-        midi_path: Path to the MIDI file
-        
-    Returns:
-        Path to the temporary WAV file or None if error
+    Stored previews are sent as files. Otherwise the preview is streamed
+    while it renders, honouring a byte range request, and stored for next
+    time; without in-process synthesis it is rendered in full first.
     """
-    try:
-        # First, create a trimmed MIDI file without silence
-        trimmed_midi = create_trimmed_midi(midi_path)
-        if not trimmed_midi:
-            return None
-            
-        # Create a temporary WAV file
-        fd, wav_path = tempfile.mkstemp(suffix='.wav')
-        os.close(fd)
-        
-        # Use FluidSynth to convert MIDI to WAV
-        cmd = [
-            'fluidsynth',
-            '-ni',
-            '-g', '0.7',  # gain (volume)
-            '-F', wav_path,
-            SOUNDFONT_PATH,
-            trimmed_midi
-        ]
-        
-        logger.info(f"Converting MIDI to WAV: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        # Check if conversion was successful
-        if result.returncode != 0:
-            logger.error(f"FluidSynth error: {result.stderr}")
-            os.remove(trimmed_midi)
-            os.remove(wav_path)
-            return None
-            
-        # Clean up the trimmed MIDI file
-        os.remove(trimmed_midi)
-        
-        return wav_path
-        
-    except Exception as e:
-        logger.error(f"MIDI to WAV conversion error: {str(e)}")
-        return None
+    stream = audio_previews.open_stream(midi_path)
+    if stream is None:
+        preview_path = audio_previews.get(midi_path)
+        if not preview_path:
+            logger.error(f"Failed to render audio preview: {midi_path}")
+            return jsonify({'error': 'Failed to process MIDI file'}), 500
+        return send_file(preview_path, mimetype=audio_previews.mimetype, conditional=True)
+
+    byte_range = request.range.range_for_length(stream.size) if request.range else None
+    start, stop = byte_range or (0, stream.size)
+    logger.info(f"Streaming audio preview bytes {start}-{stop - 1}/{stream.size}: {midi_path}")
+    response = Response(stream.chunks(start, stop), status=206 if byte_range else 200,
+                        mimetype=stream.mimetype, direct_passthrough=True)
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{stream.size}'
+    return response
 
 
 @app.route('/play/<file_id>')
@@ -261,11 +309,12 @@ def play_midi(file_id):
     try:
         logger.info(f"Requested playback for file ID: {file_id}")
         
-        if file_id not in uploaded_files:
+        upload = get_upload(file_id)
+        if upload is None:
             logger.error(f"File ID not found in uploaded files: {file_id}")
             return jsonify({'error': 'File not found'}), 404
             
-        file_path = uploaded_files[file_id]['path']
+        file_path = upload['path']
         logger.info(f"Found file at path: {file_path}")
         
         # Check if the file exists
@@ -273,236 +322,100 @@ def play_midi(file_id):
             logger.error(f"File does not exist at path: {file_path}")
             return jsonify({'error': 'File not found on disk'}), 404
         
-        # Convert MIDI to WAV
-        logger.info(f"Converting MIDI to WAV: {file_path}")
-        wav_path = midi_to_wav(file_path)
-        if not wav_path:
-            logger.error(f"Failed to convert MIDI to WAV: {file_path}")
-            return jsonify({'error': 'Failed to process MIDI file'}), 500
-        
-        logger.info(f"Successfully converted to WAV: {wav_path}")
+        return send_preview(file_path)
         
-        # Set up a callback to remove the temp file after sending
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.remove(wav_path)
-                logger.info(f"Temporary WAV file removed: {wav_path}")
-            except Exception as e:
-                logger.error(f"Error removing temp file: {str(e)}")
-            return response
-            
-        return send_file(wav_path, mimetype='audio/wav', conditional=True)
+    except SynthPoolBusy as e:
+        logger.warning(f"Audio rendering busy: {str(e)}")
+        return jsonify({'error': 'Audio rendering is busy, try again shortly'}), 503
         
     except Exception as e:
         logger.error(f"Playback error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+def resolve_result_path(result_path=None, result_id=None):
+    """Full path of a search result given its id or its path
+
+    Dataset files are looked up in the database's path index, so resolving
+    never scans the dataset directory. Paths that are not indexed, such as
+    files added since startup, are used as given or relative to the dataset.
+
+    Returns:
+        Path of the file or None if it is unknown
+    """
+    if result_id is not None:
+        return db.path_for_id(int(result_id))
+    file_id = db.resolve_path(result_path)
+    if file_id is not None:
+        return db.path_for_id(file_id)
+    for candidate in (result_path, os.path.join(DATASET_PATH, result_path)):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+@app.route('/play_result/<int:result_id>')
 @app.route('/play_result/<path:file_path>')
-def play_result(file_path):
+def play_result(file_path=None, result_id=None):
     """Serve a result MIDI file for playback with silence removed"""
     try:
-        logger.info(f"Requested playback for result file: {file_path}")
-        
-        # If the file_path is already an absolute path, use it directly
-        if os.path.isabs(file_path) and os.path.exists(file_path):
-            full_path = file_path
-            logger.info(f"Using absolute path directly: {full_path}")
-        else:
-            # Check if file_path already contains DATASET_PATH to avoid duplication
-            if file_path.startswith(DATASET_PATH):
-                full_path = file_path
-                logger.info(f"Using path as-is (already contains dataset path): {full_path}")
-            else:
-                # If not, join with DATASET_PATH
-                full_path = os.path.join(DATASET_PATH, file_path)
-                logger.info(f"Joined with dataset path: {full_path}")
-            
-            # If still not found, fall back to searching by basename
-            if not os.path.exists(full_path):
-                logger.info(f"File not found at {full_path}, attempting to find by basename")
-                basename = os.path.basename(file_path)
-                
-                # Search the whole dataset for the basename
-                for root, dirs, files in os.walk(DATASET_PATH):
-                    if basename in files:
-                        full_path = os.path.join(root, basename)
-                        logger.info(f"Found file by basename search: {full_path}")
-                        break
+        logger.info(f"Requested playback for result: {file_path if result_id is None else result_id}")
+        full_path = resolve_result_path(file_path, result_id)
         
         # Check if we found the file
-        if not os.path.exists(full_path):
-            logger.error(f"File not found: {file_path}")
+        if full_path is None or not os.path.exists(full_path):
+            logger.error(f"File not found: {file_path if result_id is None else result_id}")
             return jsonify({'error': 'File not found'}), 404
             
         logger.info(f"Using file at path: {full_path}")
         
-        # Convert MIDI to WAV
-        logger.info(f"Converting MIDI to WAV: {full_path}")
-        wav_path = midi_to_wav(full_path)
-        if not wav_path:
-            logger.error(f"Failed to convert MIDI to WAV: {full_path}")
-            return jsonify({'error': 'Failed to process MIDI file'}), 500
+        return send_preview(full_path)
             
-        logger.info(f"Successfully converted to WAV: {wav_path}")
+    except SynthPoolBusy as e:
+        logger.warning(f"Audio rendering busy: {str(e)}")
+        return jsonify({'error': 'Audio rendering is busy, try again shortly'}), 503
         
-        # Set up a callback to remove the temp file after sending
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.remove(wav_path)
-                logger.info(f"Temporary WAV file removed: {wav_path}")
-            except Exception as e:
-                logger.error(f"Error removing temp file: {str(e)}")
-            return response
-            
-        return send_file(wav_path, mimetype='audio/wav', conditional=True)
-            
     except Exception as e:
         logger.error(f"Result playback error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
-def generate_piano_roll_data(midi_path):
-    """Generate a piano roll visualization and extract key data"""
-    try:
-        midi_data = pretty_midi.PrettyMIDI(midi_path)
-        
-        # Extract key data
-        min_pitch = 127
-        max_pitch = 0
-        start_time = float('inf')
-        end_time = 0
-        all_notes = []
-        
-        # Collect all notes from non-drum instruments
-        for instrument in midi_data.instruments:
-            if not instrument.is_drum:
-                for note in instrument.notes:
-                    all_notes.append(note)
-                    min_pitch = min(min_pitch, note.pitch)
-                    max_pitch = max(max_pitch, note.pitch)
-                    start_time = min(start_time, note.start)
-                    end_time = max(end_time, note.end)
-        
-        # Set defaults if no notes found
-        if min_pitch == 127:
-            min_pitch = 60
-        if max_pitch == 0:
-            max_pitch = 72
-        if start_time == float('inf'):
-            start_time = 0
-        if end_time == 0:
-            end_time = 4
-            
-        # Calculate duration
-        duration = end_time - start_time
-        
-        # Add padding to the range, but ensure we include C and octave boundaries
-        min_pitch_octave = (min_pitch // 12) * 12  # Find nearest C below
-        max_pitch_octave = ((max_pitch // 12) + 1) * 12  # Find nearest C above
-        
-        min_pitch = max(0, min_pitch_octave - 3)
-        max_pitch = min(127, max_pitch_octave + 3)
-        
-        # Create piano roll with proper styling
-        plt.figure(figsize=(8, 3), dpi=100)
-        ax = plt.axes()
-        ax.set_facecolor('#2b2b2b')
-        
-        # Draw octave boundaries (horizontal lines)
-        octave_min = min_pitch // 12
-        octave_max = max_pitch // 12
-        
-        # Grid lines
-        for octave in range(octave_min, octave_max + 1):
-            c_pitch = octave * 12
-            if min_pitch <= c_pitch <= max_pitch:
-                plt.axhline(y=c_pitch, color='#505050', linestyle='-', linewidth=0.7)
-        
-        # Vertical grid lines (time markers)
-        beat_duration = 0.5  # Adjust based on typical beat length
-        for t in np.arange(0, duration + beat_duration, beat_duration):
-            plt.axvline(x=t, color='#404040', linestyle='-', linewidth=0.5)
-        
-        # Plot notes
-        if all_notes:
-            for note in all_notes:
-                # Calculate note position and size
-                x = note.start - start_time
-                y = note.pitch
-                width = note.end - note.start
-                height = 0.7
-                
-                # Draw the note rectangle
-                rect = plt.Rectangle(
-                    (x, y - height/2),
-                    width,
-                    height,
-                    color='#00ff00',
-                    ec='#00cc00',
-                    linewidth=1
-                )
-                ax.add_patch(rect)
-        
-        # Set axis limits
-        plt.xlim(0, duration)
-        plt.ylim(min_pitch - 1, max_pitch + 1)
-        
-        # Add note labels on y-axis
-        note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        y_ticks = []
-        y_labels = []
-        
-        for octave in range(octave_min, octave_max + 1):
-            for note_idx, note_name in enumerate(note_names):
-                pitch = octave * 12 + note_idx
-                if min_pitch <= pitch <= max_pitch:
-                    if note_idx == 0:  # Only label 'C' notes with octave
-                        y_ticks.append(pitch)
-                        y_labels.append(f'{note_name}{octave}')
-                    elif note_idx % 2 == 0:  # Label only natural notes (non-sharps)
-                        y_ticks.append(pitch)
-                        y_labels.append(note_name)
-        
-        plt.yticks(y_ticks, y_labels)
-        
-        # Add time markers on x-axis
-        time_ticks = np.arange(0, duration + 1, 1.0)
-        time_labels = [f"{start_time + t:.1f}" for t in time_ticks]
-        plt.xticks(time_ticks, time_labels)
-        
-        # Save to bytesIO and convert to base64
-        buffer = BytesIO()
-        plt.tight_layout()
-        plt.savefig(buffer, format='png', bbox_inches='tight')
-        buffer.seek(0)
-        plt.close()
-        
-        # Convert to base64 for embedding in HTML
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        # Return both image and metadata
-        return {
-            'image': f"data:image/png;base64,{img_str}",
-            'min_pitch': min_pitch,
-            'max_pitch': max_pitch,
-            'start_time': start_time,
-            'end_time': end_time,
-            'duration': duration
-        }
-        
-    except Exception as e:
-        logger.error(f"Piano roll generation error: {str(e)}")
-        return {
-            'image': "",
-            'min_pitch': 60,
-            'max_pitch': 72,
-            'start_time': 0,
-            'end_time': 4,
-            'duration': 4
-        }
+def get_piano_roll_data(midi_path):
+    """Piano roll image and metadata for a MIDI file, served from cache when possible
+
+    Dataset files are looked up by their precomputed thumbnail key; other
+    files (uploads, files added since startup) are keyed by content digest.
+    The in-memory LRU tier is checked first, then the on-disk store, and
+    only a miss in both renders the image and writes it to the store.
+    """
+    key = thumbnails.key_for(midi_path)
+    if key is None:
+        try:
+            key = thumbnail_key(midi_path)
+        except OSError as e:
+            logger.error(f"Piano roll cache key error: {str(e)}")
+            return render_piano_roll(midi_path)[1]
+
+    piano_roll_data = piano_roll_cache.get(key)
+    if piano_roll_data is not None:
+        return piano_roll_data
+
+    stored = piano_roll_store.get(key)
+    if stored is not None:
+        png, metadata = stored
+    else:
+        png, metadata = render_piano_roll(midi_path)
+        if png is None:
+            # Don't cache failures, the file may become readable later
+            return metadata
+        try:
+            piano_roll_store.put(key, png, metadata)
+        except OSError as e:
+            logger.warning(f"Could not store piano roll for {midi_path}: {str(e)}")
+
+    piano_roll_data = dict(metadata, image=data_url(png))
+    piano_roll_cache.put(key, piano_roll_data)
+    return piano_roll_data
 
 
 @app.route('/visualize_synchronized', methods=['POST'])
@@ -512,50 +425,32 @@ def visualize_synchronized():
         data = request.json
         query_file_id = data.get('query_file_id')
         result_path = data.get('result_path')
+        result_id = data.get('result_id')
+        piano_roll_mode = get_piano_roll_mode(data)
         
-        logger.info(f"Visualize synchronized request with query_file_id: {query_file_id}, result_path: {result_path}")
+        logger.info(f"Visualize synchronized request with query_file_id: {query_file_id}, "
+                    f"result_id: {result_id}, result_path: {result_path}")
         
         # Validate input
-        if not query_file_id or not result_path:
-            logger.error(f"Missing required parameter - query_file_id: {query_file_id}, result_path: {result_path}")
+        if not query_file_id or (result_id is None and not result_path):
+            logger.error(f"Missing required parameter - query_file_id: {query_file_id}, "
+                         f"result_id: {result_id}, result_path: {result_path}")
             return jsonify({'error': 'Missing required parameters'}), 400
             
-        if query_file_id not in uploaded_files:
+        upload = get_upload(query_file_id)
+        if upload is None:
             logger.error(f"Query file not found: {query_file_id}")
             return jsonify({'error': 'Query file not found'}), 404
             
-        query_path = uploaded_files[query_file_id]['path']
+        query_path = upload['path']
         logger.info(f"Query path: {query_path}")
         
-        # Handle path resolution with the same logic as in play_result
-        if os.path.isabs(result_path) and os.path.exists(result_path):
-            full_result_path = result_path
-            logger.info(f"Using absolute path directly: {full_result_path}")
-        else:
-            # Check if result_path already contains DATASET_PATH to avoid duplication
-            if result_path.startswith(DATASET_PATH):
-                full_result_path = result_path
-                logger.info(f"Using path as-is (already contains dataset path): {full_result_path}")
-            else:
-                # If not, join with DATASET_PATH
-                full_result_path = os.path.join(DATASET_PATH, result_path)
-                logger.info(f"Joined with dataset path: {full_result_path}")
-            
-            # If still not found, fall back to searching by basename
-            if not os.path.exists(full_result_path):
-                logger.info(f"File not found at {full_result_path}, attempting to find by basename")
-                basename = os.path.basename(result_path)
-                
-                # Search the whole dataset for the basename
-                for root, dirs, files in os.walk(DATASET_PATH):
-                    if basename in files:
-                        full_result_path = os.path.join(root, basename)
-                        logger.info(f"Found file by basename search: {full_result_path}")
-                        break
+        # Resolve the result the same way as play_result
+        full_result_path = resolve_result_path(result_path, result_id)
         
         # Final check
-        if not os.path.exists(full_result_path):
-            logger.error(f"Result file not found: {result_path}")
+        if full_result_path is None or not os.path.exists(full_result_path):
+            logger.error(f"Result file not found: {result_path if result_id is None else result_id}")
             return jsonify({'error': 'Result file not found'}), 404
             
         try:
@@ -609,6 +504,18 @@ def visualize_synchronized():
         min_pitch = max(0, min_pitch - 2)
         max_pitch = min(127, max_pitch + 2)
         
+        # Ship the notes on the shared scale and let the browser draw them
+        if piano_roll_mode == 'notes':
+            return jsonify({
+                'query_notes': pack_notes(*note_arrays(query_midi), query_start),
+                'result_notes': pack_notes(*note_arrays(result_midi), result_start),
+                'query_start': query_start,
+                'result_start': result_start,
+                'min_pitch': min_pitch,
+                'max_pitch': max_pitch,
+                'total_duration': total_duration
+            })
+        
         # Generate visualizations with the same scale
         query_img = generate_unified_piano_roll(query_midi, query_start, min_pitch, max_pitch, total_duration)
         result_img = generate_unified_piano_roll(result_midi, result_start, min_pitch, max_pitch, total_duration)
@@ -629,91 +536,44 @@ def visualize_synchronized():
 def generate_unified_piano_roll(midi_data, start_time, min_pitch, max_pitch, total_duration):
     """Generate a piano roll with unified scale for comparison"""
     try:
-        # Create piano roll with proper styling
-        plt.figure(figsize=(8, 3), dpi=100)
-        ax = plt.axes()
-        ax.set_facecolor('#2b2b2b')
-        
-        # Draw octave boundaries (horizontal lines)
-        octave_min = min_pitch // 12
-        octave_max = max_pitch // 12
-        
-        # Grid lines
-        for octave in range(octave_min, octave_max + 1):
-            c_pitch = octave * 12
-            if min_pitch <= c_pitch <= max_pitch:
-                plt.axhline(y=c_pitch, color='#505050', linestyle='-', linewidth=0.7)
-        
-        # Vertical grid lines (time markers)
-        beat_duration = 0.5  # Adjust based on typical beat length
-        for t in np.arange(0, total_duration + beat_duration, beat_duration):
-            plt.axvline(x=t, color='#404040', linestyle='-', linewidth=0.5)
-        
-        # Plot notes
-        has_notes = False
-        for instrument in midi_data.instruments:
-            if not instrument.is_drum:
-                for note in instrument.notes:
-                    has_notes = True
-                    # Calculate note position and size
-                    x = note.start - start_time
-                    y = note.pitch
-                    width = note.end - note.start
-                    height = 0.7
-                    
-                    # Draw the note rectangle
-                    rect = plt.Rectangle(
-                        (x, y - height/2),
-                        width,
-                        height,
-                        color='#00ff00',
-                        ec='#00cc00',
-                        linewidth=1
-                    )
-                    ax.add_patch(rect)
-        
-        # Set consistent axis limits
-        plt.xlim(0, total_duration)
-        plt.ylim(min_pitch - 1, max_pitch + 1)
-        
-        # Add note labels on y-axis
-        note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        y_ticks = []
-        y_labels = []
-        
-        for octave in range(octave_min, octave_max + 1):
-            for note_idx, note_name in enumerate(note_names):
-                pitch = octave * 12 + note_idx
-                if min_pitch <= pitch <= max_pitch:
-                    if note_idx == 0:  # Only label 'C' notes with octave
-                        y_ticks.append(pitch)
-                        y_labels.append(f'{note_name}{octave}')
-                    elif note_idx % 2 == 0:  # Label only natural notes (non-sharps)
-                        y_ticks.append(pitch)
-                        y_labels.append(note_name)
-        
-        plt.yticks(y_ticks, y_labels)
-        
-        # Add time markers on x-axis
-        time_ticks = np.arange(0, total_duration + 1, 1.0)
-        time_labels = [f"{start_time + t:.1f}" for t in time_ticks]
-        plt.xticks(time_ticks, time_labels)
-        
-        # Save to bytesIO and convert to base64
-        buffer = BytesIO()
-        plt.tight_layout()
-        plt.savefig(buffer, format='png', bbox_inches='tight')
-        buffer.seek(0)
-        plt.close()
-        
-        # Convert to base64 for embedding in HTML
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        return f"data:image/png;base64,{img_str}"
-        
+        onsets, offsets, pitches = note_arrays(midi_data)
+        png = piano_roll_renderer.render(onsets, offsets, pitches, start_time,
+                                         min_pitch, max_pitch, total_duration)
+        return data_url(png)
+
     except Exception as e:
         logger.error(f"Unified piano roll generation error: {str(e)}")
         return ""
 
 
+@app.route('/healthz')
+def healthz():
+    """Liveness probe: the worker process is answering requests"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: the search index is loaded and searches can be served"""
+    ready = db.index is not None
+    return jsonify({
+        'ready': ready,
+        'files': len(db.file_paths),
+        'index_type': db.index_type
+    }), 200 if ready else 503
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Report hit, miss and eviction counters of the web app caches"""
+    return jsonify({
+        'piano_roll_memory': piano_roll_cache.stats(),
+        'piano_roll_store': piano_roll_store.stats(),
+        'uploads': uploaded_files.stats(),
+        'audio_previews': audio_previews.stats(),
+        'synth_pool': synth_pool.stats() if synth_pool is not None else None
+    })
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
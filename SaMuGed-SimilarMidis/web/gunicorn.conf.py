@@ -0,0 +1,47 @@
+"""gunicorn settings for serving the web app in production
+
+Run from the project directory, where the dataset and cache paths resolve:
+
+    gunicorn -c web/gunicorn.conf.py
+
+The app is imported once in the master process (preload_app), so the
+feature store, search index and thumbnails are loaded or built a single
+time before WEB_WORKERS workers are forked. The feature matrix and index
+are memory-mapped from cache/ and everything else built at startup is
+shared copy-on-write, so more workers add request concurrency without
+repeating the startup work or multiplying the index in memory.
+"""
+import gc
+import os
+import sys
+
+WEB_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(WEB_DIR))
+
+import faiss
+from config import WEB_BIND, WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT
+
+wsgi_app = 'app:app'
+pythonpath = WEB_DIR
+preload_app = True
+
+bind = WEB_BIND
+workers = WEB_WORKERS
+worker_class = 'gthread'
+threads = WEB_THREADS
+timeout = WEB_TIMEOUT
+
+
+def pre_fork(server, worker):
+    # Objects created while preloading live for the whole run; moving them out
+    # of the collector's reach keeps collections in the workers from writing to
+    # (and so copying) the pages they share with the master
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Requests already run in parallel on the workers' threads. One OpenMP
+    # thread per search avoids oversubscribing the cores, and also avoids the
+    # OpenMP thread pool the master may have used while building the index,
+    # which does not survive the fork
+    faiss.omp_set_num_threads(1)
@@ -1,5 +1,6 @@
 import numpy as np
 import os
+import sys
 from collections import Counter, defaultdict
 
 from miditoolkit.midi.parser import MidiFile
@@ -10,6 +11,10 @@ from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from scipy.spatial.distance import euclidean
 
+# Add the parent directory to the path so we can import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from meter_map import MeterMap
+
 def segment_midi_to_bars(midi_file):
     """
     Segments a MIDI file into bars for each track
@@ -27,6 +32,7 @@ def segment_midi_to_bars(midi_file):
         print(f'Unable to open {midi_file}')
         return None, None
 
+    meter = MeterMap.from_miditoolkit(midi_obj)
     segments_by_track = {}
     timings_by_track = {}
 
@@ -40,14 +46,12 @@ def segment_midi_to_bars(midi_file):
         track_start = sorted_notes[0].start
         track_end = max(note.end for note in sorted_notes)
         
-        time_sig = midi_obj.time_signature_changes[0]  # assume time signature doesn't change
-        ticks_per_bar = time_sig.numerator * midi_obj.ticks_per_beat * 4 // time_sig.denominator
-        
         bars = []
         timings = []
-        current_bar_start = track_start - (track_start % ticks_per_bar)
-        while current_bar_start < track_end:
-            bar_end = min(current_bar_start + ticks_per_bar, track_end)
+        # Bars follow the time signature changes, a change mid-bar starts a new bar
+        for bar in range(meter.bar_at(track_start), meter.bar_at(track_end - 1) + 1):
+            current_bar_start = meter.bar_start(bar)
+            bar_end = min(meter.bar_end(bar), track_end)
             bar_notes = [note for note in sorted_notes if note.start < bar_end and note.end > current_bar_start]
             
             if bar_notes:  # only add the bar if it contains notes
@@ -57,8 +61,6 @@ def segment_midi_to_bars(midi_file):
                     'notes': bar_notes
                 })
                 timings.append((current_bar_start, bar_end))
-            
-            current_bar_start += ticks_per_bar
 
         segments_by_track[track_idx] = bars
         timings_by_track[track_idx] = timings
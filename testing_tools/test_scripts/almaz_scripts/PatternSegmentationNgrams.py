@@ -1,13 +1,20 @@
+import os
+import sys
 import mido
+import bisect
 import numpy as np
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
+from itertools import accumulate
 import matplotlib.pyplot as plt
 import json
 
+# Add the parent directory to the path so we can import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from meter_map import MeterMap
+
 def parse_midi_file(midi_file):
     mid = mido.MidiFile(midi_file)
     tracks = defaultdict(list)
-    time_signature = None
     ticks_per_beat = mid.ticks_per_beat
     
     for i, track in enumerate(mid.tracks):
@@ -15,9 +22,7 @@ def parse_midi_file(midi_file):
         active_notes = {}
         for msg in track:
             time += msg.time
-            if msg.type == 'time_signature':
-                time_signature = (msg.numerator, msg.denominator)
-            elif msg.type == 'note_on' and msg.velocity > 0:
+            if msg.type == 'note_on' and msg.velocity > 0:
                 active_notes[msg.note] = (time, msg.velocity)
             elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
                 if msg.note in active_notes:
@@ -26,65 +31,184 @@ def parse_midi_file(midi_file):
                     tracks[i].append((msg.note, start_time, duration, velocity))
                     del active_notes[msg.note]
     
-    if time_signature is None:
-        time_signature = (4, 4)  # Default to 4/4 if not specified
+    # Bar positions for all time signature changes, 4/4 if not specified
+    meter = MeterMap.from_mido(mid)
     
-    return tracks, time_signature, ticks_per_beat
+    return tracks, meter, ticks_per_beat
+
+# Two polynomial hashes, combined into one 62-bit key per n-gram. Both moduli
+# are below 2**31, so hash * power stays within int64.
+HASH_MODULI = (2147483647, 2147483629)
+HASH_BASES = (911382323, 972663749)
+
+def encode_sequence(sequence):
+    # Distinct values as tokens 1..k, so hashes depend only on equality of values
+    _, inverse = np.unique(np.asarray(sequence), return_inverse=True)
+    return inverse.astype(np.int64).ravel() + 1
 
-def calculate_bar_length(time_signature, ticks_per_beat):
-    numerator, denominator = time_signature
-    return numerator * ticks_per_beat * 4 // denominator
+def prefix_hashes(tokens, max_n):
+    hashes = []
+    for base, modulus in zip(HASH_BASES, HASH_MODULI):
+        prefix = [0]
+        for token in tokens.tolist():
+            prefix.append((prefix[-1] * base + token) % modulus)
+        powers = [1]
+        for _ in range(max_n):
+            powers.append(powers[-1] * base % modulus)
+        hashes.append((np.array(prefix, dtype=np.int64), powers, modulus))
+    return hashes
 
-def find_ngrams(sequence, n):
-    ngrams = [tuple(sequence[i:i+n]) for i in range(len(sequence)-n+1)]
-    return ngrams
+def ngram_keys(hashes, n):
+    # Hash of every n-gram from the prefix hashes, O(1) per position
+    (prefix1, powers1, modulus1), (prefix2, powers2, modulus2) = hashes
+    key1 = (prefix1[n:] - prefix1[:-n] * powers1[n]) % modulus1
+    key2 = (prefix2[n:] - prefix2[:-n] * powers2[n]) % modulus2
+    return (key1 << 31) | key2
+
+def find_ngrams(sequence, tokens, hashes, n, min_occurrences):
+    # (ngram, count) of the n-grams occurring at least min_occurrences times, in order of first occurrence
+    if n > len(tokens):
+        return []
+    _, first, inverse, counts = np.unique(ngram_keys(hashes, n), return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    frequent = counts >= min_occurrences
+    positions = np.flatnonzero(frequent[inverse])
+    if len(positions) == 0:
+        return []
+
+    # Verify that the n-grams sharing a hash are equal; colliding groups are counted exactly
+    windows = np.lib.stride_tricks.sliding_window_view(tokens, n)
+    mismatched = (windows[positions] != windows[first[inverse[positions]]]).any(axis=1)
+    colliding = np.zeros(len(counts), dtype=bool)
+    colliding[inverse[positions[mismatched]]] = True
+
+    ngrams = [(first[group], tuple(sequence[first[group]:first[group] + n]), int(counts[group]))
+              for group in np.flatnonzero(frequent & ~colliding)]
+    if colliding.any():
+        exact = Counter()
+        first_seen = {}
+        for i in np.flatnonzero(colliding[inverse]).tolist():
+            ngram = tuple(sequence[i:i + n])
+            exact[ngram] += 1
+            first_seen.setdefault(ngram, i)
+        ngrams.extend((first_seen[ngram], ngram, count) for ngram, count in exact.items() if count >= min_occurrences)
+    ngrams.sort(key=lambda x: x[0])
+    return [(ngram, count) for _, ngram, count in ngrams]
 
 def find_frequent_patterns(sequence, max_ngram_size, min_occurrences):
     longest_frequent_patterns = []
     ngram_frequencies = {}
+    max_ngram_size = min(max_ngram_size, len(sequence))
+    if max_ngram_size < 1:
+        return longest_frequent_patterns, ngram_frequencies
     
-    # Analyze n-grams from longest to shortest
-    for n in range(max_ngram_size, 0, -1):
-        ngrams = find_ngrams(sequence, n)
-        ngram_counts = Counter(ngrams)
-        frequent_patterns = [(ngram, count) for ngram, count in ngram_counts.items() if count >= min_occurrences]
-        
-        for pattern, count in frequent_patterns:
-            if pattern not in ngram_frequencies:
-                ngram_frequencies[pattern] = count
-
+    tokens = encode_sequence(sequence)
+    hashes = prefix_hashes(tokens, max_ngram_size)
+    
+    # Every occurrence of a frequent n-gram is also one of its (n-1)-gram prefix,
+    # so the longest n with a frequent n-gram can be found by binary search
+    low, high = 0, max_ngram_size
+    while low < high:
+        n = (low + high + 1) // 2
+        frequent_patterns = find_ngrams(sequence, tokens, hashes, n, min_occurrences)
         if frequent_patterns:
+            low = n
             longest_frequent_patterns = frequent_patterns
-            break  # Stop as soon as we find the longest frequent pattern
+        else:
+            high = n - 1
+    
+    for pattern, count in longest_frequent_patterns:
+        ngram_frequencies[pattern] = count
 
     return longest_frequent_patterns, ngram_frequencies
 
-def segment_track(track, duration_patterns, pitch_patterns, bar_length, min_bars, max_bars, silent_regions):
+def build_automaton(patterns):
+    # Aho-Corasick automaton: a trie of the patterns with failure links and, per node, the patterns ending there
+    goto = [{}]
+    fail = [0]
+    output = [[]]
+    for index, pattern in enumerate(patterns):
+        node = 0
+        for token in pattern:
+            if token not in goto[node]:
+                goto[node][token] = len(goto)
+                goto.append({})
+                fail.append(0)
+                output.append([])
+            node = goto[node][token]
+        output[node].append(index)
+    
+    # Failure links point to the longest proper suffix that is also in the trie
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for token, child in goto[node].items():
+            queue.append(child)
+            suffix = fail[node]
+            while suffix and token not in goto[suffix]:
+                suffix = fail[suffix]
+            fail[child] = goto[suffix][token] if node and token in goto[suffix] else 0
+            output[child] = output[child] + output[fail[child]]
+    return goto, fail, output
+
+def match_patterns(automaton, sequence):
+    # (end index, pattern index) of every occurrence of the patterns, in one pass over the sequence
+    goto, fail, output = automaton
+    node = 0
+    for i, token in enumerate(sequence):
+        while node and token not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(token, 0)
+        for index in output[node]:
+            yield i, index
+
+def merge_silent_regions(silent_regions):
+    # Sorted, non-overlapping (start, end) regions covering the same ticks
+    merged = []
+    for start, end in sorted(region for region in silent_regions if region[0] < region[1]):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [region[0] for region in merged], [region[1] for region in merged]
+
+def in_silent_region(silence, time):
+    starts, ends = silence
+    i = bisect.bisect_right(starts, time) - 1
+    return i >= 0 and time < ends[i]
+
+def segment_track(track, duration_patterns, pitch_patterns, meter, min_bars, max_bars, silent_regions):
     boundaries = set()
     
     # Add boundaries based on strongest patterns
     all_patterns = duration_patterns + pitch_patterns
-    for pattern, _ in all_patterns[:20]:  # Use top 20 patterns
-        for i, (note, start_time, duration, velocity) in enumerate(track):
-            segment = track[i:i+len(pattern)]
-            segment_durations = tuple(note[2] for note in segment)
-            segment_pitches = tuple(note[0] for note in segment)
-            if segment_durations == pattern or segment_pitches == pattern:
-                if not any(s_start <= start_time < s_end for s_start, s_end in silent_regions):
-                    boundaries.add(start_time)
-                    boundaries.add(start_time + sum(d[2] for d in segment))
+    patterns = list(dict.fromkeys(pattern for pattern, _ in all_patterns[:20]))  # Use top 20 patterns
+    automaton = build_automaton(patterns)
+    silence = merge_silent_regions(silent_regions)
+    durations = [note[2] for note in track]
+    elapsed = [0, *accumulate(durations)]  # Sum of the durations before each note
+    
+    # A pattern marks a segment wherever it matches the durations or the pitches
+    for sequence in (durations, [note[0] for note in track]):
+        for end, index in match_patterns(automaton, sequence):
+            i = end - len(patterns[index]) + 1
+            start_time = track[i][1]
+            if not in_silent_region(silence, start_time):
+                boundaries.add(start_time)
+                boundaries.add(start_time + elapsed[end + 1] - elapsed[i])
     
     # Add additional boundaries to satisfy min/max bar constraints
     boundaries = sorted(list(boundaries))
     filtered_boundaries = [boundaries[0]]
     for boundary in boundaries[1:]:
-        if boundary - filtered_boundaries[-1] > max_bars * bar_length:
+        # Bar lengths follow the time signature at the previous boundary
+        if boundary - filtered_boundaries[-1] > max_bars * meter.ticks_per_bar(filtered_boundaries[-1]):
             # Add intermediate boundaries
             current = filtered_boundaries[-1]
-            while current + max_bars * bar_length < boundary:
-                current += max_bars * bar_length
+            while current + max_bars * meter.ticks_per_bar(current) < boundary:
+                current += max_bars * meter.ticks_per_bar(current)
                 filtered_boundaries.append(current)
-        if boundary - filtered_boundaries[-1] >= min_bars * bar_length:
+        if boundary - filtered_boundaries[-1] >= min_bars * meter.ticks_per_bar(filtered_boundaries[-1]):
             filtered_boundaries.append(boundary)
     
     return filtered_boundaries
@@ -118,7 +242,7 @@ def extract_segments(track, boundaries):
         segments.append(segment)
     return segments
 
-def visualize_segmentation(track, boundaries, bar_length, min_bars, max_bars):
+def visualize_segmentation(track, boundaries, meter, min_bars, max_bars):
     plt.figure(figsize=(15, 10))
     
     # Plot pitches
@@ -147,7 +271,7 @@ def visualize_segmentation(track, boundaries, bar_length, min_bars, max_bars):
         
         # Add bar lines
         max_time = max(note[1] for note in track)
-        for bar in range(0, int(max_time), int(bar_length)):
+        for bar in meter.bar_starts(0, int(max_time)):
             ax.axvline(x=bar, color='gray', linestyle=':', alpha=0.5, linewidth=0.5)
     
     plt.suptitle(f'Segmentation (Min: {min_bars} bars, Max: {max_bars} bars)')
@@ -155,8 +279,7 @@ def visualize_segmentation(track, boundaries, bar_length, min_bars, max_bars):
     plt.show()
 
 def analyze_midi_file(midi_file, output_file, min_bars, max_bars, max_ngram_size, min_occurrences, silence_threshold):
-    tracks, time_signature, ticks_per_beat = parse_midi_file(midi_file)
-    bar_length = calculate_bar_length(time_signature, ticks_per_beat)
+    tracks, meter, ticks_per_beat = parse_midi_file(midi_file)
     
     all_track_boundaries = {}
     segment_reports = {}
@@ -178,12 +301,12 @@ def analyze_midi_file(midi_file, output_file, min_bars, max_bars, max_ngram_size
         silent_regions = detect_silence(track, silence_threshold)
 
         # Pass silent regions to the segment_track function
-        boundaries = segment_track(track, duration_patterns, pitch_patterns, bar_length, min_bars, max_bars, silent_regions)
+        boundaries = segment_track(track, duration_patterns, pitch_patterns, meter, min_bars, max_bars, silent_regions)
         
         all_track_boundaries[track_num] = boundaries
         
         print(f"Found {len(boundaries)-1} segments in track {track_num}")
-        visualize_segmentation(track, boundaries, bar_length, min_bars, max_bars)
+        visualize_segmentation(track, boundaries, meter, min_bars, max_bars)
         
         # Record segment report
         segment_reports[track_num] = {
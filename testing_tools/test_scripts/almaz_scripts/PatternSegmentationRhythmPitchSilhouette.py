@@ -1,4 +1,5 @@
 import os
+import sys
 import mido
 from collections import defaultdict
 import numpy as np
@@ -6,6 +7,11 @@ from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 from music21 import chord
 
+# Add the parent directory to the path so we can import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from meter_map import MeterMap
+from repeat_finder import encode_tokens, maximal_repeats
+
 def extract_midi_metadata(midi_file):
     """
     Extract metadata from a MIDI file.
@@ -338,8 +344,9 @@ def find_repeating_motifs(notes, min_length=8, max_length=128, quantize_duration
     Note:
         This function identifies repeating patterns of notes, considering both pitch and rhythm.
         It quantizes note durations to allow for slight timing variations in pattern matching.
+        Only maximal repeats are returned, i.e. motifs that cannot be extended on either side
+        without losing an occurrence; longer ones are cut to max_length.
     """
-    motifs = {}
     chord_sequence = []
     current_chord = []
     current_time = -1
@@ -356,19 +363,13 @@ def find_repeating_motifs(notes, min_length=8, max_length=128, quantize_duration
     if current_chord:
         chord_sequence.append((tuple(sorted(current_chord)), 0))
     
-    for length in range(min_length, min(max_length, len(chord_sequence)) + 1):
-        for i in range(len(chord_sequence) - length + 1):
-            motif = tuple(chord_sequence[i:i+length])
-            if motif in motifs:
-                motifs[motif]['positions'].append(i)
-            else:
-                motifs[motif] = {'id': len(motifs), 'positions': [i], 'score': 0}
-    
-    # Calculate scores based on frequency and length
-    for motif, data in motifs.items():
-        data['score'] = len(data['positions']) * len(motif)
+    # Maximal repeats from a suffix array over the chord sequence. A shorter
+    # repeat inside one of them is left out unless it also occurs elsewhere.
+    repeating_motifs = {}
+    for length, positions in maximal_repeats(encode_tokens(chord_sequence), min_length, max_length):
+        motif = tuple(chord_sequence[positions[0]:positions[0] + length])
+        repeating_motifs[motif] = {'id': len(repeating_motifs), 'positions': positions, 'score': len(positions) * length}
     
-    repeating_motifs = {m: v for m, v in motifs.items() if len(v['positions']) > 1}
     sorted_motifs = sorted(repeating_motifs.items(), key=lambda x: x[1]['score'], reverse=True)
     
     print(f"Found {len(sorted_motifs)} repeating motifs")
@@ -376,7 +377,7 @@ def find_repeating_motifs(notes, min_length=8, max_length=128, quantize_duration
         print("Top motif:", sorted_motifs[0][0])
     return dict(sorted_motifs)
 
-def segment_track(notes, repeating_motifs, rhythmic_boundaries, ticks_per_bar):
+def segment_track(notes, repeating_motifs, rhythmic_boundaries, meter):
     """
     Segment a track based on repeating motifs and rhythmic boundaries.
 
@@ -384,7 +385,7 @@ def segment_track(notes, repeating_motifs, rhythmic_boundaries, ticks_per_bar):
         notes (list): List of note information tuples (pitch, start_time, duration, velocity).
         repeating_motifs (dict): Dictionary of repeating motifs found in the track.
         rhythmic_boundaries (list): List of rhythmic boundary times.
-        ticks_per_bar (int): Number of ticks in one bar.
+        meter (MeterMap): Bar positions of the MIDI file.
 
     Returns:
         list: List of segment tuples (start_time, end_time, repetition_count, motif, motif_id).
@@ -405,10 +406,8 @@ def segment_track(notes, repeating_motifs, rhythmic_boundaries, ticks_per_bar):
             end_tick = start_tick + sum(duration for _, duration in motif)
             
             # Adjust segment to align with musical bars
-            start_bar = start_tick // ticks_per_bar
-            end_bar = (end_tick + ticks_per_bar - 1) // ticks_per_bar
-            adjusted_start = start_bar * ticks_per_bar
-            adjusted_end = end_bar * ticks_per_bar
+            adjusted_start = meter.floor(start_tick)
+            adjusted_end = meter.ceil(end_tick)
             
             # Check for overlap with existing segments or used notes
             if not any(s <= adjusted_start < adjusted_end <= e for s, e, _, _, _ in segments) and \
@@ -423,8 +422,8 @@ def segment_track(notes, repeating_motifs, rhythmic_boundaries, ticks_per_bar):
     for segment in segments:
         if segment[0] > last_end:
             # Add a non-motif segment to fill the gap
-            gap_start = (last_end // ticks_per_bar) * ticks_per_bar
-            gap_end = (segment[0] // ticks_per_bar) * ticks_per_bar
+            gap_start = meter.floor(last_end)
+            gap_end = meter.floor(segment[0])
             if gap_end > gap_start:
                 filled_segments.append((gap_start, gap_end, 1, (), -1))
         filled_segments.append(segment)
@@ -432,19 +431,19 @@ def segment_track(notes, repeating_motifs, rhythmic_boundaries, ticks_per_bar):
     
     # Add final segment if needed
     if last_end < notes[-1][1]:
-        final_start = (last_end // ticks_per_bar) * ticks_per_bar
-        final_end = ((notes[-1][1] + ticks_per_bar - 1) // ticks_per_bar) * ticks_per_bar
+        final_start = meter.floor(last_end)
+        final_end = meter.ceil(notes[-1][1])
         filled_segments.append((final_start, final_end, 1, (), -1))
     
     return filled_segments
 
-def merge_small_segments(segments, ticks_per_bar):
+def merge_small_segments(segments, meter):
     """
     Merge small segments to create more meaningful larger segments.
 
     Args:
         segments (list): List of segment tuples (start_time, end_time, repetition_count, motif, motif_id).
-        ticks_per_bar (int): Number of ticks in one bar.
+        meter (MeterMap): Bar positions of the MIDI file.
 
     Returns:
         list: List of merged segment tuples.
@@ -455,12 +454,15 @@ def merge_small_segments(segments, ticks_per_bar):
     """
     merged = []
     current_segment = None
-    min_segment_length = 2 * ticks_per_bar
+    min_segment_bars = 2
+
+    def bar_count(segment):
+        return meter.bar_at(segment[1]) - meter.bar_at(segment[0])
 
     for segment in segments:
         if current_segment is None:
             current_segment = segment
-        elif segment[1] - segment[0] < min_segment_length or current_segment[1] - current_segment[0] < min_segment_length:
+        elif bar_count(segment) < min_segment_bars or bar_count(current_segment) < min_segment_bars:
             # Merge small segments
             current_segment = (
                 min(current_segment[0], segment[0]),
@@ -577,12 +579,10 @@ def process_track(track_notes, track_index, original_midi, output_dir, input_fil
     
     repeating_motifs = find_repeating_motifs(track_notes, min_length=4, max_length=100)
     
-    # Calculate ticks_per_bar
-    ticks_per_beat = metadata['ticks_per_beat']
-    beats_per_bar = initial_time_signature[0]
-    ticks_per_bar = ticks_per_beat * beats_per_bar
+    # Bar positions for all time signature changes
+    meter = MeterMap.from_mido(original_midi)
     
-    segments = segment_track(track_notes, repeating_motifs, rhythmic_boundaries, ticks_per_bar)
+    segments = segment_track(track_notes, repeating_motifs, rhythmic_boundaries, meter)
 
     if len(segments) == 0:
         print("Warning: No segments found for this track.")
@@ -1,3 +1,4 @@
+import bisect
 import numpy as np
 import os
 import sys
@@ -16,12 +17,22 @@ from scipy.stats import skew, kurtosis
 from scipy.spatial.distance import euclidean
 from scipy.spatial.distance import cdist
 
+# Add the parent directory to the path so we can import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from meter_map import MeterMap
+
 
 def get_segments(mid_obj: str | object) -> list:
     """
     Takes path to a midifile or a class instance of miditoolkit.midi.parser.MidiFile
 
     Returns a list of tracks, each track is a list of segments, each segment containing notes.
+
+    A segment ends when no note has been playing for one bar. Instead of stepping
+    through every tick, the notes are walked in onset order: overlapping notes are
+    merged into runs of sound, and the silence after each run is checked for the
+    tick where it reaches one bar, so the cost depends on the number of notes and
+    time signatures, not on the length of the song in ticks.
     """
 
     # 1:01:00 is the first(0th) tick in flstudio
@@ -39,60 +50,51 @@ def get_segments(mid_obj: str | object) -> list:
         print(f'Input not a path or instance of MidiFile class')
         return None
 
-    ticks_per_beat = mid_obj.ticks_per_beat
-    time_signatures = mid_obj.time_signature_changes
+    meter = MeterMap.from_miditoolkit(mid_obj)
 
     tracks = []  # This list will contain a list for each track, each list containing segments
 
     for ins_nr, instrument in enumerate(mid_obj.instruments):
         if instrument.is_drum == True:
             continue
-        # if ins_nr > 2: #just here for testing
-        #    break
         notes = instrument.notes
-        sorted_notes = sorted(notes, key=lambda x: x.start)
-        first_note_start = np.inf
-        last_note_end = 0
-        for note in sorted_notes:
-            if note.start < first_note_start:
-                first_note_start = note.start
-            if note.end > last_note_end:
-                last_note_end = note.end
-        # print(f'Track: {ins_nr}, {instrument=}\n {first_note_start=}, {last_note_end=}')
-
-        note_playing = False  # Is a note playing?
-        note_playing_end = 0  # The tick the currently active note will end on
-        # Set value greater than 384 so that we don't save an empty segment at the start
-        ticks_since_last_note = 385
+        if not notes:
+            tracks.append([])
+            continue
+        last_note_end = max(note.end for note in notes)
+        # Notes starting on or after the last note end are never reached
+        sorted_notes = [note for note in sorted(notes, key=lambda x: x.start)
+                        if note.start < last_note_end]
+
         segments = []  # The list where segments/samples will be saved
         temp = []  # Temporary list that keeps track of notes in the current segment
-        notes_to_remove = []  # Empty set to keep track of note indecies in the list of notes
-
-        for tick in range(0, last_note_end):
-            notes_to_remove = []  # Empty set to keep track of note indecies in the list of notes
-            if note_playing == False:  # Increment silence counter if no note is playing
-                ticks_since_last_note += 1
-            elif tick >= note_playing_end:  # Check if the playing note has ended
-                note_playing = False
-                note_playing_end = 0
-            # Iterate through notes to see if they are currently playing
-            for x, note in enumerate(sorted_notes):
-                if tick == note.start:
-                    temp.append(note)
-                    note_playing = True
-                    note_playing_end = note.end if note.end > note_playing_end else note_playing_end
-                    ticks_since_last_note = 0
-                    # Add played notes to a list so we can remove them later
-                    notes_to_remove.append(note)
-
-            # Remove played notes from list of notes to reduce code execution time
-            for note in notes_to_remove[::-1]:
-                sorted_notes.remove(note)
-
-            # save segment when 1 bar has passed since end of last note
-            if ticks_since_last_note == ticks_per_bar(ticks_per_beat, tick, time_signatures):
+        # Tick the silence counter is measured from, None before the first note
+        # so that we don't save an empty segment at the start
+        silence_origin = None
+        silence_start = 0  # First silent tick since the last note stopped
+
+        i = 0
+        while True:
+            # A segment is saved on every silent tick where the silence reaches one bar
+            silence_end = sorted_notes[i].start if i < len(sorted_notes) else last_note_end
+            for _ in range(count_bar_silences(meter, silence_origin, silence_start, silence_end)):
                 segments.append(temp)
                 temp = []
+            if i == len(sorted_notes):
+                break
+
+            # Collect the run of notes that keeps a note playing. Sound stops on the
+            # first tick at or after the latest note end (at least one tick after
+            # the note started); a note starting on that tick continues the run
+            run_end = sorted_notes[i].start + 1
+            while i < len(sorted_notes) and sorted_notes[i].start <= run_end:
+                note = sorted_notes[i]
+                temp.append(note)
+                run_end = max(run_end, note.end, note.start + 1)
+                i += 1
+
+            silence_origin = run_end
+            silence_start = run_end + 1
 
         if len(temp) > 0:
             segments.append(temp)
@@ -103,6 +105,26 @@ def get_segments(mid_obj: str | object) -> list:
     return tracks
 
 
+def count_bar_silences(meter, silence_origin, first_tick, last_tick) -> int:
+    """Number of ticks in range(first_tick, last_tick) where tick - silence_origin equals the bar length"""
+
+    if silence_origin is None:
+        return 0
+    change_ticks, lengths = meter.change_ticks, meter.bar_lengths
+    count = 0
+    k = max(bisect.bisect_right(change_ticks, first_tick) - 1, 0)
+    while k < len(lengths):
+        piece_start = first_tick if k == 0 else max(first_tick, change_ticks[k])
+        piece_end = last_tick if k + 1 == len(lengths) else min(last_tick, change_ticks[k + 1])
+        if piece_start >= last_tick:
+            break
+        if piece_start <= silence_origin + lengths[k] < piece_end:
+            count += 1
+        k += 1
+
+    return count
+
+
 # Add note offset check, pitch offset check
 def compare_notes(segment, note_number, compare_note_number, current_pattern, duration_difference=10) -> bool:
     """Returns True if the notes have the same pitch and within specified duration difference"""
@@ -130,19 +152,6 @@ def compare_notes(segment, note_number, compare_note_number, current_pattern, du
     return False
 
 
-def ticks_per_bar(ticks_per_beat, current_note_time, time_signatures) -> int:
-
-    if len(time_signatures) == 0:  # If there is no timesignatures in the midi we assume 4 beats per bar
-        return 384
-
-    for i in time_signatures:
-        if i.time > current_note_time:
-            break
-        ticks = ticks_per_beat * i.numerator
-
-    return ticks
-
-
 def add_and_reset_current(active_pattern, current_pattern, list_of_patterns_in_current_segment, note_number, compare_note_number, old_note_number, previous_compare_match):
     active_pattern = False
     if len(current_pattern) > 2:  # TODO Use sf_segmenter for boundaries to help with boundaries of patterns
@@ -181,8 +190,7 @@ def asle(INPUT_PATH, OUTPUT_DIR, ONE_FILE_PER_PATTERN):
 
     tracks = get_segments(mid_obj)
 
-    ticks_per_beat = mid_obj.ticks_per_beat
-    time_signatures = mid_obj.time_signature_changes
+    meter = MeterMap.from_miditoolkit(mid_obj)
 
     list_of_all_patterns = []
     pattern_number = 1
@@ -211,7 +219,7 @@ def asle(INPUT_PATH, OUTPUT_DIR, ONE_FILE_PER_PATTERN):
                 if compare_notes(segment=segment, note_number=note_number, current_pattern=current_pattern, compare_note_number=compare_note_number):
                     if not active_pattern:  # If this is the start of a new pattern
                         # Sets the minimum length limit to 1 bar
-                        if segment[compare_note_number].end - segment[note_number].start >= ticks_per_bar(ticks_per_beat, segment[note_number].start, time_signatures):
+                        if segment[compare_note_number].end - segment[note_number].start >= meter.ticks_per_bar(segment[note_number].start):
                             pattern_end = segment[compare_note_number].start
                             # save start of pattern so we can go back when current pattern ends
                             old_note_number = note_number
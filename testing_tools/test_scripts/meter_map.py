@@ -0,0 +1,88 @@
+import bisect
+
+
+class MeterMap:
+    """
+    Bar positions of a MIDI file, following its time signature changes.
+
+    Bars are numbered from 0 at tick 0. Every time signature change starts a new
+    bar, so a change in the middle of a bar shortens that bar. Ticks before the
+    first time signature are in 4/4, the MIDI default. The bar number at each
+    change is precomputed, so converting between ticks and bars is a bisect over
+    the time signature changes, O(log n) for n changes.
+    """
+
+    def __init__(self, ticks_per_beat, time_signatures=()):
+        """
+        Args:
+            ticks_per_beat (int): Ticks per quarter note.
+            time_signatures (iterable): (tick, numerator, denominator) tuples, one per time signature change.
+        """
+        changes = {}
+        for tick, numerator, denominator in sorted(time_signatures, key=lambda x: x[0]):
+            # The last of several changes on the same tick wins
+            changes[int(tick)] = max(1, numerator * ticks_per_beat * 4 // denominator)
+        changes.setdefault(0, ticks_per_beat * 4)
+
+        self.ticks_per_beat = ticks_per_beat
+        self.change_ticks = sorted(changes)  # Tick of each time signature change
+        self.bar_lengths = [changes[tick] for tick in self.change_ticks]  # Ticks per bar from each change on
+        self.change_bars = [0]  # Bar number starting at each change
+        for k in range(1, len(self.change_ticks)):
+            span = self.change_ticks[k] - self.change_ticks[k - 1]
+            self.change_bars.append(self.change_bars[-1] - (-span // self.bar_lengths[k - 1]))
+
+    @classmethod
+    def from_miditoolkit(cls, midi_obj):
+        """Meter map of a miditoolkit MidiFile"""
+        return cls(midi_obj.ticks_per_beat,
+                   [(ts.time, ts.numerator, ts.denominator) for ts in midi_obj.time_signature_changes])
+
+    @classmethod
+    def from_mido(cls, midi_file):
+        """Meter map of a mido MidiFile, from the time_signature messages of all tracks"""
+        time_signatures = []
+        for track in midi_file.tracks:
+            tick = 0
+            for msg in track:
+                tick += msg.time
+                if msg.type == 'time_signature':
+                    time_signatures.append((tick, msg.numerator, msg.denominator))
+        return cls(midi_file.ticks_per_beat, time_signatures)
+
+    def _change_at_tick(self, tick):
+        return max(bisect.bisect_right(self.change_ticks, tick) - 1, 0)
+
+    def ticks_per_bar(self, tick):
+        """Length in ticks of a full bar in the time signature at tick"""
+        return self.bar_lengths[self._change_at_tick(tick)]
+
+    def bar_at(self, tick):
+        """Number of the bar containing tick"""
+        k = self._change_at_tick(tick)
+        return self.change_bars[k] + (tick - self.change_ticks[k]) // self.bar_lengths[k]
+
+    def bar_start(self, bar):
+        """First tick of a bar"""
+        k = max(bisect.bisect_right(self.change_bars, bar) - 1, 0)
+        return self.change_ticks[k] + (bar - self.change_bars[k]) * self.bar_lengths[k]
+
+    def bar_end(self, bar):
+        """Tick after the last tick of a bar, i.e. the start of the next bar"""
+        return self.bar_start(bar + 1)
+
+    def floor(self, tick):
+        """Start of the bar containing tick"""
+        return self.bar_start(self.bar_at(tick))
+
+    def ceil(self, tick):
+        """First bar start at or after tick"""
+        start = self.floor(tick)
+        return start if start == tick else self.bar_end(self.bar_at(tick))
+
+    def bar_starts(self, start, end):
+        """Start ticks of the bars beginning in range(start, end)"""
+        if end <= start:
+            return []
+        return [self.bar_start(bar) for bar in range(self.bar_at(start - 1) + 1 if start > 0 else 0,
+                                                     self.bar_at(end - 1) + 1)]
@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def encode_tokens(sequence):
+    """
+    Replace each hashable item of a sequence by an integer id.
+
+    Equal items get equal ids, numbered in order of first appearance.
+
+    Returns:
+        numpy.ndarray: int64 array of token ids, one per item.
+    """
+    ids = {}
+    return np.array([ids.setdefault(item, len(ids)) for item in sequence], dtype=np.int64)
+
+
+def suffix_array(tokens):
+    """
+    Suffix array of an integer token sequence by prefix doubling.
+
+    Each round sorts the suffixes by their first 2k tokens using the ranks of
+    the first k, so there are O(log n) rounds of NumPy sorting.
+
+    Args:
+        tokens (numpy.ndarray): Non-negative integer tokens.
+
+    Returns:
+        numpy.ndarray: Start positions of the suffixes in lexicographic order.
+    """
+    n = len(tokens)
+    rank = np.asarray(tokens, dtype=np.int64)
+    sa = np.argsort(rank, kind='stable')
+    k = 1
+    while n > 1:
+        # A suffix that ends within k tokens sorts before all its extensions
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n - k] = rank[k:]
+        sa = np.lexsort((second, rank))
+        changed = (rank[sa][1:] != rank[sa][:-1]) | (second[sa][1:] != second[sa][:-1])
+        rank = np.empty(n, dtype=np.int64)
+        rank[sa] = np.concatenate(([0], np.cumsum(changed)))
+        if rank[sa[-1]] == n - 1 or k >= n:
+            break
+        k *= 2
+    return sa
+
+
+def lcp_array(tokens, sa):
+    """
+    Longest common prefix of each suffix with the one before it in the suffix array (Kasai's algorithm).
+
+    Returns:
+        list: lcp[i] is the common prefix length of suffixes sa[i - 1] and sa[i], lcp[0] is 0.
+    """
+    n = len(tokens)
+    tokens = tokens.tolist()
+    sa = sa.tolist()
+    rank = [0] * n
+    for i, suffix in enumerate(sa):
+        rank[suffix] = i
+    lcp = [0] * n
+    h = 0
+    for suffix in range(n):
+        if rank[suffix] == 0:
+            h = 0
+            continue
+        previous = sa[rank[suffix] - 1]
+        while suffix + h < n and previous + h < n and tokens[suffix + h] == tokens[previous + h]:
+            h += 1
+        lcp[rank[suffix]] = h
+        if h > 0:
+            h -= 1
+    return lcp
+
+
+def maximal_repeats(tokens, min_length, max_length):
+    """
+    Repeats of a token sequence, found from its suffix and LCP arrays.
+
+    Every node of the suffix tree is an LCP interval, a run of the suffix array
+    whose suffixes share a prefix no shorter than the LCP values inside it. The
+    intervals are visited bottom-up with a stack in one pass over the LCP array.
+    An interval of length min_length to max_length is a maximal repeat, and is
+    reported, when its occurrences are not all preceded by the same token, as
+    it could otherwise be extended to the left with the same occurrences.
+    Repeats of max_length or more tokens are reported once, cut to their first
+    max_length tokens, for the largest interval that shares that prefix.
+
+    Args:
+        tokens (numpy.ndarray): Non-negative integer tokens.
+        min_length (int): Minimum repeat length.
+        max_length (int): Maximum repeat length.
+
+    Returns:
+        list: (length, positions) tuples, positions being the sorted start indices of the repeat.
+    """
+    n = len(tokens)
+    if n < 2 or min_length > max_length:
+        return []
+    sa = suffix_array(tokens)
+    lcp = lcp_array(tokens, sa) + [0]
+    sa = sa.tolist()
+    tokens = tokens.tolist()
+    diverse = -1  # Left token of an interval whose suffixes are preceded by different tokens
+
+    def left_token(i):
+        return tokens[sa[i] - 1] if sa[i] > 0 else diverse
+
+    repeats = []
+    # Open intervals as [lcp, left boundary, left token]
+    stack = [[0, 0, diverse]]
+    for i in range(1, n + 1):
+        left_boundary = i - 1
+        left = left_token(i - 1)
+        while lcp[i] < stack[-1][0]:
+            length, left_boundary, interval_left = stack.pop()
+            if interval_left != left:
+                interval_left = diverse
+            parent_length = max(lcp[i], stack[-1][0])
+            if length >= max_length:
+                if parent_length < max_length:
+                    repeats.append((max_length, sorted(sa[left_boundary:i])))
+            elif length >= min_length and interval_left == diverse:
+                repeats.append((length, sorted(sa[left_boundary:i])))
+            left = interval_left
+        if lcp[i] > stack[-1][0]:
+            stack.append([lcp[i], left_boundary, left])
+        elif stack[-1][2] != left:
+            stack[-1][2] = diverse
+    return repeats